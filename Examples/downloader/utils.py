@@ -21,6 +21,6 @@ def add_to_csv(file_path, content):
     """Reads a CSV file, appends DataFrame content, and
     writes back to file."""
     dataframe = pd.read_csv(file_path)
-    dataframe = dataframe.append(content)
+    dataframe = pd.concat([dataframe, content])
 
     dataframe.to_csv(file_path)
@@ -99,8 +99,6 @@ def main():  # pylint:disable=too-many-locals
             sys.stdout.write('\r' + progress)
             sys.stdout.flush()
 
-            ## Using threads>1 may speed up your downloads, but may also cause issues on Windows.
-            ## Use with caution.
             data = client.get_channel_data(all_data[all_data['segments.startTime']
                                                     == start_time_ms], threads=5)
 
@@ -77,17 +77,17 @@ def get_string_from_list_of_dicts(list_of_dicts):
     return labels_string
 
 
-GET_STUDY_WITH_DATA = """
-    query study_with_data($study_id: String!, $limit: PaginationAmount, $offset: Int) {
-        study (id: $study_id) {
+STUDY_FIELDS = """
             id
+            name
             patient {
                 id
                 user {
                     fullName
                 }
-            }
-            name
+            }"""
+
+STUDY_WITH_DATA_FIELDS = STUDY_FIELDS + """
             description
             startTime
             duration
@@ -123,9 +123,30 @@ GET_STUDY_WITH_DATA = """
                         category
                     }
                 }
-            }
-        }
-    }"""
+            }"""
+
+GET_STUDY_WITH_DATA = f"""
+    query study_with_data($study_id: String!, $limit: PaginationAmount, $offset: Int) {{
+        study (id: $study_id) {{{STUDY_WITH_DATA_FIELDS}
+        }}
+    }}"""
+
+
+def get_studies_with_data_query_string(num_studies):
+    """
+    Build a query fetching the same details as `GET_STUDY_WITH_DATA` for `num_studies` studies in
+    one request. The study IDs are passed as variables `$s0`, `$s1`, ... (along with `$limit` and
+    `$offset`), and each study's details are returned under the matching alias `s0`, `s1`, ...
+    """
+    aliases = [f's{i}' for i in range(num_studies)]
+    variables = ''.join(f', ${alias}: String!' for alias in aliases)
+    selections = ''.join(f"""
+        {alias}: study (id: ${alias}) {{{STUDY_WITH_DATA_FIELDS}
+        }}""" for alias in aliases)
+    return f"""
+    query studies_with_data($limit: PaginationAmount, $offset: Int{variables}) {{{selections}
+    }}"""
+
 
 GET_LABELS_PAGED = """
     query labels($study_id: String!,
@@ -288,37 +309,21 @@ def get_data_chunk_urls_query_string(data_chunks, s3_urls=True):
         }""" % (chunk_keys, s3_urls)
 
 
-GET_STUDIES_BY_SEARCH_TERM_PAGED = """
+GET_STUDIES_BY_SEARCH_TERM_PAGED = f"""
     query studies($search_term: String,
                   $limit: PaginationAmount,
-                  $offset: Int) {
-        studies (searchTerm: $search_term, limit: $limit, offset: $offset) {
-            id
-            name
-            patient {
-                id
-                user {
-                    fullName
-                }
-            }
-        }
-    }"""
+                  $offset: Int) {{
+        studies (searchTerm: $search_term, limit: $limit, offset: $offset) {{{STUDY_FIELDS}
+        }}
+    }}"""
 
-GET_STUDIES_BY_STUDY_ID_PAGED = """
+GET_STUDIES_BY_STUDY_ID_PAGED = f"""
     query studies($study_ids: [String],
                   $limit: PaginationAmount,
-                  $offset: Int) {
-        studies (studyIds: $study_ids, limit: $limit, offset: $offset) {
-            id
-            name
-            patient {
-                id
-                user {
-                    fullName
-                }
-            }
-        }
-    }"""
+                  $offset: Int) {{
+        studies (studyIds: $study_ids, limit: $limit, offset: $offset) {{{STUDY_FIELDS}
+        }}
+    }}"""
 
 ADD_LABELS = """
     mutation addLabelsToLabelGroup($group_id: String!,
@@ -33,14 +33,18 @@ Concepts
 - API response: Data returned from the GraphQL endpoint, as a dictionary with string-type keys, and
     values that may be strings, numbers, bools, dictionaries, lists of dicts etc.
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import functools
 import logging
 import math
+import random
 import time
 import json
 from copy import deepcopy
 
 from gql import gql, Client as GQLClient
+from gql.transport.exceptions import TransportAlreadyConnected
 from gql.transport.requests import RequestsHTTPTransport
 import pandas as pd
 try:
@@ -56,6 +60,71 @@ from . import graphql
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+QUERY_POOL_SIZE = 32
+
+
+# the constant query strings defined in `graphql`, which are worth parsing only once
+CONSTANT_QUERY_STRINGS = frozenset(
+    value for name, value in vars(graphql).items() if name.isupper() and isinstance(value, str))
+
+
+def parse_query(query_string):
+    """
+    Parse a GraphQL query string into a document. The constant queries in `graphql` only have
+    their variable values change between calls (e.g. when paginating), so each of those is only
+    lexed and parsed once. Generated query strings (e.g. embedding lists of IDs) are rarely
+    repeated, so they are parsed each time rather than kept in memory.
+
+    Parameters
+    ----------
+    query_string : str
+        The GraphQL query
+
+    Returns
+    -------
+    document : graphql.DocumentNode or gql.GraphQLRequest
+        The parsed query as returned by `gql()`, suitable for passing to `gql.Client.execute()`
+    """
+    if query_string in CONSTANT_QUERY_STRINGS:
+        return _parse_constant_query(query_string)
+    return gql(query_string)
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_constant_query(query_string):
+    """
+    Internal function. Parse one of the `CONSTANT_QUERY_STRINGS`, caching the result. The cache
+    can't grow beyond the number of constant queries.
+    """
+    return gql(query_string)
+
+
+class SessionRequestsHTTPTransport(RequestsHTTPTransport):
+    """
+    A `RequestsHTTPTransport` which sends requests through an existing `requests.Session` rather
+    than opening (and closing) a new one for every query. This lets connections to the API be
+    reused across queries, avoiding a new TCP connection and TLS handshake each time.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session to send requests through. It is left open when the transport is closed
+    **kwargs
+        Passed on to `RequestsHTTPTransport`
+    """
+    def __init__(self, session, **kwargs):
+        super().__init__(**kwargs)
+        self.shared_session = session
+
+    def connect(self):
+        if self.session is not None:
+            raise TransportAlreadyConnected('Transport is already connected')
+        self.session = self.shared_session
+
+    def close(self):
+        # detach from, but don't close, the shared session so its connections can be reused
+        self.session = None
+
 
 class SeerConnect:  # pylint: disable=too-many-public-methods
     graphql_client = None
@@ -92,18 +161,25 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
 
         self.create_client()
 
-        self.last_query_time = time.time()
         self.api_limit_expire = 300
         self.api_limit = 580
+        # allow up to `api_limit` queries in any `api_limit_expire` second window
+        self.rate_limiter = utils.SlidingWindowRateLimiter(self.api_limit, self.api_limit_expire)
+        # responses to idempotent metadata queries, see `execute_cached_query()`
+        self.query_cache = utils.TTLCache(maxsize=1024, ttl=300)
 
     def create_client(self):
         """Create a GraphQL client with parameters from the current SeerAuth object."""
+        # connection parameters (e.g. auth headers) can change between queries, so a new client is
+        # created for each query, but they all share one pooled session
+        session = utils.create_session(QUERY_POOL_SIZE)
+
         def graphql_client(party_id=None):
             connection_params = self.seer_auth.get_connection_parameters(party_id)
-            return GQLClient(transport=RequestsHTTPTransport(**connection_params))
+            return GQLClient(
+                transport=SessionRequestsHTTPTransport(session=session, **connection_params))
 
         self.graphql_client = graphql_client
-        self.last_query_time = time.time()
 
     def execute_query(self, query_string, party_id=None, invocations=0, variable_values=None):
         """
@@ -117,7 +193,7 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         party_id : str, optional
             The organisation/entity to specify for the query
         invocations : int, optional
-            Used for recursive calls; don't set directly
+            Number of attempts already made; don't set directly
         variable_values : dict, optional
             Values for GraphQL to substitute into the query
 
@@ -127,6 +203,7 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             Query results as a dictionary matching the structure of the query
         """
         resolvable_api_errors = [
+            '429 Client Error',
             '502 Server Error',
             '503 Server Error',
             '504 Server Error',
@@ -134,36 +211,71 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             'NOT_AUTHENTICATED',
             'SERVER_ERROR'  # 500 server error raised by gql library
         ]
+        max_invocations = 5
+
+        document = parse_query(query_string)
+        # newer versions of gql wrap the parsed DocumentNode in a GraphQLRequest
+        definitions = getattr(document, 'document', document).definitions
+        operations = [getattr(definition, 'operation', None) for definition in definitions]
+        if any(operation is not None and operation.value == 'mutation' for operation in operations):
+            # a mutation may change anything we have cached
+            self.query_cache.clear()
 
-        try:
-            time.sleep(
-                max(0., ((self.api_limit_expire / self.api_limit) -
-                         (time.time() - self.last_query_time))))
-            response = self.graphql_client(party_id).execute(gql(query_string),
+        while True:
+            try:
+                self.rate_limiter.acquire()
+                return self.graphql_client(party_id).execute(document,
                                                              variable_values=variable_values)
-            self.last_query_time = time.time()
-            return response
-        except Exception as ex:
-            if invocations > 4:
-                logger.error('Too many failed query invocations, raising error')
-                raise
-            error_string = repr(ex)
-            if any(api_error in error_string for api_error in resolvable_api_errors):
+            except Exception as ex:  # pylint:disable=broad-except
+                if invocations >= max_invocations:
+                    logger.error('Too many failed query invocations, raising error')
+                    raise
+                error_string = repr(ex)
+                if not any(api_error in error_string for api_error in resolvable_api_errors):
+                    raise
+
                 if self.seer_auth.handle_query_error_pre_sleep(ex):
-                    logger.warning(f'"{error_string}" raised, trying again after a short break')
-                    time.sleep(
-                        min(30 * (invocations + 1)**2,
-                            max(self.last_query_time + self.api_limit_expire - time.time(), 0)))
+                    # exponential backoff, with jitter so that concurrent clients don't retry in
+                    # lockstep
+                    sleep_for = min(60, 2**invocations) + random.uniform(0, 1)
+                    logger.warning(f'"{error_string}" raised, trying again after {sleep_for:.1f}s')
+                    time.sleep(sleep_for)
 
                 invocations += 1
 
                 self.seer_auth.handle_query_error_post_sleep(error_string)
 
-                return self.execute_query(query_string, party_id, invocations=invocations,
-                                          variable_values=variable_values)
+    def execute_cached_query(self, query_string, party_id=None, variable_values=None):
+        """
+        Execute an idempotent GraphQL query, returning a recent response to the identical query if
+        one is cached. Responses are held for `query_cache.ttl` seconds, and the cache is cleared
+        whenever a mutation is executed through this client. Cached responses are copied on the way
+        in and out, so this is meant for small responses which are read repeatedly (e.g. channel
+        groups), not for large one-off queries or responses that can go stale quickly (e.g. data
+        chunk URLs).
+
+        Parameters
+        ----------
+        query_string: str
+            The GraphQL query
+        party_id : str, optional
+            The organisation/entity to specify for the query
+        variable_values : dict, optional
+            Values for GraphQL to substitute into the query
 
-            raise
+        Returns
+        -------
+        graphql_results : dict
+            Query results as a dictionary matching the structure of the query
+        """
+        key = (query_string, party_id, json.dumps(variable_values, sort_keys=True))
+        response = self.query_cache.get(key)
+        if response is None:
+            response = self.execute_query(query_string, party_id, variable_values=variable_values)
+            self.query_cache.set(key, response)
+        return response
 
+    # pylint:disable=too-many-arguments
     def get_paginated_response(self, query_string, variable_values, limit, object_path,
                                iteration_path=None, party_id=None, max_items=None):
         """
@@ -211,58 +323,135 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         responses: list of dict
             List of query result dictionaries
         """
+        pages = self._iter_paginated_pages(query_string, variable_values, limit, object_path,
+                                           iteration_path, party_id, max_items)
+        result = []
+        for page_number, (page, response_increment) in enumerate(pages):
+            if page_number == 0:
+                # the first page gives the entire top level response
+                result = page
+            elif response_increment:
+                # add each later increment to the existing result at the correct level
+                values_container = result
+                if iteration_path:
+                    values_container = utils.get_nested_dict_item(values_container, iteration_path)
+                values_container.extend(response_increment)
+
+        return result
+
+    # pylint:disable=too-many-arguments
+    def iter_paginated_response(self, query_string, variable_values, limit, object_path,
+                                iteration_path=None, party_id=None, max_items=None):
+        """
+        Generator equivalent of `get_paginated_response()`. Rather than accumulating all pages into
+        a single result, yield the varying part of each page (the list found at `iteration_path`,
+        or at `object_path` if `iteration_path` is None) as soon as it is retrieved. This allows
+        callers to start processing results before all pages have been fetched, without holding
+        every page in memory.
+
+        Parameters
+        ----------
+        See `get_paginated_response()`
+
+        Yields
+        ------
+        response_increment : list of dict
+            The items returned by a single query iteration
+        """
+        pages = self._iter_paginated_pages(query_string, variable_values, limit, object_path,
+                                           iteration_path, party_id, max_items)
+        for _, response_increment in pages:
+            if response_increment:
+                yield response_increment
+
+    # pylint:disable=too-many-arguments
+    def _iter_paginated_pages(self, query_string, variable_values, limit, object_path,
+                              iteration_path, party_id, max_items):
+        """
+        Internal function. The offset-based paging loop shared by `get_paginated_response()` and
+        `iter_paginated_response()`. Yields each page as a tuple of (the response at
+        `object_path`, the part of it at `iteration_path`), stopping after the first page whose
+        varying part is empty, or once `max_items` items have been returned.
+        """
         variable_values = deepcopy(variable_values)  # prevent local changes affecting external one
-        variable_values['limit'] = limit
         offset = variable_values.get('offset', 0)  # Try get offset from variable values if exists
-        result = []
         total_items_returned = 0
 
-        is_first_iteration = True
         while True:
             # Update the number of items remaining
             # And set the limit for the final batch if needed
             if max_items is not None:
                 remaining_items = max_items - total_items_returned
-                limit = min(remaining_items, limit)
-                variable_values['limit'] = limit
                 if remaining_items <= 0:
-                    break
+                    return
+                limit = min(remaining_items, limit)
 
+            variable_values['limit'] = limit
             variable_values['offset'] = offset  # update pagination location
             response = self.execute_query(query_string, variable_values=variable_values,
                                           party_id=party_id)
 
             # select the part of the response we are interested in
-            response = utils.get_nested_dict_item(response, object_path)
-
-            # If first iteration, then assign the entire top level response to results 
-            if is_first_iteration:
-                result = response
+            page = utils.get_nested_dict_item(response, object_path)
 
             # select the part of the response which can vary. if iteration_path is None this will be
             # the same as the part of the response we are interested in
-            response_increment = response
+            response_increment = page
             if iteration_path:
                 response_increment = utils.get_nested_dict_item(response_increment, iteration_path)
+
+            yield page, response_increment
             if not response_increment:
                 # if the part of the response which varies is empty, we are finished iterating
-                break
+                return
 
             # Update the number of items received
             total_items_returned += len(response_increment)
+            offset += limit
 
-            if is_first_iteration:
-                is_first_iteration = False
-            else:
-                # otherwise add the response increment to the existing result at the correct level
-                values_container = result
-                if iteration_path:
-                    values_container = utils.get_nested_dict_item(values_container, iteration_path)
-                values_container.extend(response_increment)
+    # pylint:disable=too-many-arguments
+    def get_cursor_paginated_response(self, query_string, variable_values, limit, object_path,
+                                      party_id=None):
+        """
+        For queries which support cursor-based pagination, retrieve all items by following the
+        cursor returned with each page. Unlike offset-based pagination (see
+        `get_paginated_response()`), the server does not need to skip over all previous items to
+        find each page, so the cost of each page stays constant.
 
-            offset += limit
+        The query must accept `$limit` and `$after` variables, and return an object with `items`
+        and `pageInfo { endCursor hasNextPage }` at `object_path`.
 
-        return result
+        Parameters
+        ----------
+        query_string : str
+            The GraphQL query
+        variable_values : dict
+            Values for GraphQL to substitute into the query
+        limit : int
+            Batch size for repeated API calls. Does not affect the total number of items retrieved
+        object_path : list of str
+            One or more levels of key giving the path to the paginated object, e.g. for query
+            result {"resource": {"list": {"items": [...], "pageInfo": {...}}}}, provide
+            ['resource', 'list']
+        party_id : str, optional
+            The organisation/entity to specify for the query
+
+        Returns
+        -------
+        items : list of dict
+            All items returned across every page
+        """
+        variable_values = {'after': '', **variable_values, 'limit': limit}
+
+        items = []
+        while True:
+            response = self.execute_query(query_string, variable_values=variable_values,
+                                          party_id=party_id)
+            body = utils.get_nested_dict_item(response, object_path)
+            items.extend(body['items'])
+            if not body['pageInfo']['hasNextPage']:
+                return items
+            variable_values = {**variable_values, 'after': body['pageInfo']['endCursor']}
 
     @staticmethod  # maybe this could move to a utility class
     def pandas_flatten(parent, parent_name, child_name):
@@ -300,19 +489,25 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         1          7.0          NaN       A
         2          NaN          8.0       B
         """
-        child_list = []
-        for i in range(len(parent)):
-            parent_id = parent[parent_name + 'id'][i]
-            cell_to_flatten = parent[parent_name + child_name][i]
-            if isinstance(cell_to_flatten, list):
-                child = json_normalize(cell_to_flatten).sort_index(axis=1)
-                child.columns = [child_name + '.' + str(col) for col in child.columns]
-                child[parent_name + 'id'] = parent_id
-                child_list.append(child)
-
-        if child_list:
-            child = pd.concat(child_list, sort=True).reset_index(drop=True)
-        if not child_list or child.empty:
+        # gather the dicts from every cell and normalize them in a single call, rather than
+        # normalizing each cell separately and concatenating the results
+        records = []
+        parent_ids = []
+        # an empty parent (e.g. a label group with no labels) may not have a child column at all
+        if parent_name + child_name in parent.columns:
+            for parent_id, cell_to_flatten in zip(parent[parent_name + 'id'],
+                                                  parent[parent_name + child_name]):
+                if isinstance(cell_to_flatten, list):
+                    records.extend(cell_to_flatten)
+                    parent_ids.extend([parent_id] * len(cell_to_flatten))
+
+        child = None
+        if records:
+            child = json_normalize(records)
+            child.columns = [child_name + '.' + str(col) for col in child.columns]
+            child[parent_name + 'id'] = parent_ids
+            child = child.sort_index(axis=1)
+        if child is None or child.empty:
             columns = [parent_name + 'id', child_name + '.id']
             child = pd.DataFrame(columns=columns)
         return child
@@ -541,6 +736,24 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
                                            variable_values, limit, ['studies'], party_id=party_id,
                                            max_items=max_items)
 
+    def iter_studies(self, limit=50, search_term='', party_id=None, max_items=None):
+        """
+        Iterate over study dicts page by page, rather than retrieving all studies before returning.
+        See `get_studies()` for details.
+
+        Yields
+        ------
+        studies : list of dict
+            Study details for a single page of results, each having keys:
+            - id
+            - name
+            - patient
+        """
+        variable_values = {'search_term': search_term}
+        yield from self.iter_paginated_response(graphql.GET_STUDIES_BY_SEARCH_TERM_PAGED,
+                                                variable_values, limit, ['studies'],
+                                                party_id=party_id, max_items=max_items)
+
     def get_studies_dataframe(self, limit=50, search_term='', party_id=None, max_items=None):
         """
         Get details of study IDs, names and patient info as a DataFrame. See `get_studies()` for
@@ -641,7 +854,7 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             - segments
         """
         query_string = graphql.get_channel_groups_query_string(study_id)
-        response = self.execute_query(query_string)
+        response = self.execute_cached_query(query_string)
         return response['study']['channelGroups']
 
     def get_channel_segments(self, study_id, limit=5000, channel_group_id=None):
@@ -668,18 +881,10 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         if not study_id:
             raise ValueError('Please provide a study ID')
 
-        items = []
-        has_next = True
-        variable_values = {'study_id': study_id, 'limit': limit, 'after': ""}
-        while has_next:
-            response = self.execute_query(graphql.STUDY_CHANNEL_GROUP_SEGMENTS,
-                                          variable_values=variable_values)
-            body = response['resource']['channelGroupSegment']['list']
-            items.extend(body['items'])
-            has_next = body['pageInfo']['hasNextPage']
-            end_cursor = response['resource']['channelGroupSegment']['list']['pageInfo'][
-                'endCursor']
-            variable_values['after'] = end_cursor
+        variable_values = {'study_id': study_id}
+        items = self.get_cursor_paginated_response(graphql.STUDY_CHANNEL_GROUP_SEGMENTS,
+                                                   variable_values, limit,
+                                                   ['resource', 'channelGroupSegment', 'list'])
 
         if not items:
             return pd.DataFrame(columns=[
@@ -724,6 +929,7 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         while int(counter * limit) < len(segment_ids):
             segment_ids_batch = segment_ids[int(counter * limit):int((counter + 1) * limit)]
             query_string = graphql.get_segment_urls_query_string(segment_ids_batch)
+            # not cached: responses are large, rarely repeated, and the URLs can expire
             response = self.execute_query(query_string)
             segments.extend([
                 segment for segment in response['studyChannelGroupSegments'] if segment is not None
@@ -851,6 +1057,28 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         return self.get_paginated_response(graphql.GET_LABELS_PAGED, variable_values, limit,
                                            ['study'], ['labelGroup', 'labels'], max_items=max_items)
 
+    # pylint:disable=too-many-arguments
+    def iter_labels(self, study_id, label_group_id, from_time=0, to_time=9e12, limit=200,
+                    max_items=None):
+        """
+        Iterate over labels for a given study and label group page by page, rather than retrieving
+        all labels before returning. See `get_labels()` for details.
+
+        Yields
+        ------
+        labels : list of dict
+            Details of the labels in a single page of results
+        """
+        variable_values = {
+            'study_id': study_id,
+            'label_group_id': label_group_id,
+            'from_time': from_time,
+            'to_time': to_time
+        }
+        yield from self.iter_paginated_response(graphql.GET_LABELS_PAGED, variable_values, limit,
+                                                ['study'], ['labelGroup', 'labels'],
+                                                max_items=max_items)
+
     # pylint:disable=too-many-arguments
     def get_labels_dataframe(self, study_id, label_group_id, from_time=0, to_time=9e12, limit=200,
                              offset=0, max_items=None):
@@ -1001,17 +1229,27 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         label_groups_df : pd.DataFrame
             Columns with details on name, id, type, number of labels, study ID and name
         """
-        label_groups = []
+        # build each column directly rather than a dict per row, so the DataFrame constructor does
+        # not have to infer columns from every row's keys
+        columns = {
+            'labelGroup.id': [],
+            'labelGroup.name': [],
+            'labelGroup.description': [],
+            'labelGroup.numberOfLabels': [],
+            'id': [],
+            'name': []
+        }
         for study in self.get_label_groups_for_studies(study_ids, limit=limit):
             for label_group in study['labelGroups']:
-                label_group['labelGroup.id'] = label_group.pop('id')
-                label_group['labelGroup.name'] = label_group.pop('name')
-                label_group['labelGroup.description'] = label_group.pop('description')
-                label_group['labelGroup.numberOfLabels'] = label_group.pop('numberOfLabels')
-                label_group['id'] = study['id']
-                label_group['name'] = study['name']
-                label_groups.append(label_group)
-        return pd.DataFrame(label_groups)
+                columns['labelGroup.id'].append(label_group['id'])
+                columns['labelGroup.name'].append(label_group['name'])
+                columns['labelGroup.description'].append(label_group['description'])
+                columns['labelGroup.numberOfLabels'].append(label_group['numberOfLabels'])
+                columns['id'].append(study['id'])
+                columns['name'].append(study['name'])
+        if not columns['id']:
+            return pd.DataFrame()
+        return pd.DataFrame(columns)
 
     def get_viewed_times_dataframe(self, study_id, limit=250, offset=0):
         """
@@ -1031,23 +1269,24 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         times_df : pd.DataFrame
             Includes columns 'id', 'startTime', 'duration' and 'user'
         """
+        # accumulate plain view dicts across all pages and build a single DataFrame at the end,
+        # rather than a DataFrame per view group per page
         views = []
         while True:
             query_string = graphql.get_viewed_times_query_string(study_id, limit, offset)
             response = self.execute_query(query_string)
-            response = json_normalize(response['viewGroups']).sort_index(axis=1)
-            non_empty_views = False
-            for i in range(len(response)):
-                view = json_normalize(response.at[i, 'views']).sort_index(axis=1)
-                view['user'] = response.at[i, 'user.fullName']
-                if not view.empty:
-                    non_empty_views = True
-                    views.append(view)
-            if not non_empty_views:
+            page_views = [
+                dict(view, user=utils.get_nested_dict_item(
+                    view_group, ['user', 'fullName'], allow_missing_keys=True))
+                for view_group in response['viewGroups'] for view in view_group['views'] or []
+            ]
+            if not page_views:
                 break
+            views.extend(page_views)
             offset += limit
         if views:
-            views = pd.concat(views).reset_index(drop=True)
+            views = json_normalize(views)
+            views = views[sorted(column for column in views.columns if column != 'user') + ['user']]
             views['createdAt'] = pd.to_datetime(views['createdAt'])
             views['updatedAt'] = pd.to_datetime(views['updatedAt'])
         else:
@@ -1494,7 +1733,8 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             study_ids = self.get_study_ids_from_names(study_names, party_id)
         return self.get_all_study_metadata_by_ids(study_ids)
 
-    def get_all_study_metadata_by_ids(self, study_ids=None, limit=5000):
+    def get_all_study_metadata_by_ids(self, study_ids=None, limit=5000, threads=1,
+                                      batch_size=20):
         """
         Get all metadata available about studies with supplied IDs.
 
@@ -1505,6 +1745,12 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             available studies.
         limit : int, optional
             Batch size for repeated API calls
+        threads : int, optional
+            Number of queries to run concurrently (default 1). Queries still share the client's
+            rate limit. Only use more than one thread with an established session: re-authenticating
+            (which may prompt for credentials) is not thread-safe.
+        batch_size : int, optional
+            Number of studies to request in a single query
 
         Returns
         -------
@@ -1518,33 +1764,80 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         elif not study_ids:  # treat empty list as asking for nothing, not everything
             return {'studies': []}
 
-        full_result = []
-        for study_id in study_ids:
-            query_variables = {'study_id': study_id, 'offset': 0, 'limit': limit}
-            study_result = self.execute_query(graphql.GET_STUDY_WITH_DATA,
-                                              variable_values=query_variables)['study']
-            max_segments_returned = total_segments_returned = max(
-                [len(channel_group['segments']) for channel_group in study_result['channelGroups']])
+        study_id_batches = [
+            study_ids[i:i + batch_size] for i in range(0, len(study_ids), batch_size)
+        ]
+        get_study_metadata = functools.partial(self._get_study_metadata_batch, limit=limit)
+        if threads > 1 and len(study_id_batches) > 1:
+            # each batch is an independent, I/O-bound query, so fetch them concurrently
+            with ThreadPoolExecutor(max_workers=min(threads, len(study_id_batches))) as executor:
+                results = list(executor.map(get_study_metadata, study_id_batches))
+        else:
+            results = [get_study_metadata(batch) for batch in study_id_batches]
 
-            # If any channel groups have at least `limit` segments, paginate
-            # Can't use get_paginated_result() because need to paginate within a nested list
-            while max_segments_returned == limit:
-                query_variables['offset'] = total_segments_returned
-                result = self.execute_query(graphql.GET_STUDY_WITH_DATA,
-                                            variable_values=query_variables)['study']
+        return {'studies': [study_result for batch in results for study_result in batch]}
+
+    def _get_study_metadata_batch(self, study_ids, limit):
+        """
+        Internal function. Get all metadata for several studies, requesting the first page of
+        segments for every study in a single aliased query, then paginating over the remaining
+        segments of any study that has more.
 
-                for i, channel_group in enumerate(result['channelGroups']):
-                    if len(channel_group['segments']) > 0:
-                        study_result['channelGroups'][i]['segments'].extend(
-                            channel_group['segments'])
+        Parameters
+        ----------
+        study_ids : list of str
+            Unique IDs, each identifying a study
+        limit : int
+            Batch size for repeated API calls
+
+        Returns
+        -------
+        study_metadata : list of dict
+            Study details in the same order as `study_ids`, see `get_all_study_metadata_by_ids()`
+        """
+        query_string = graphql.get_studies_with_data_query_string(len(study_ids))
+        variable_values = {f's{i}': study_id for i, study_id in enumerate(study_ids)}
+        variable_values.update({'offset': 0, 'limit': limit})
+        # not cached: study metadata is large, usually fetched once, and then extended in place
+        response = self.execute_query(query_string, variable_values=variable_values)
+
+        study_results = [response[f's{i}'] for i in range(len(study_ids))]
+        for study_id, study_result in zip(study_ids, study_results):
+            self._get_remaining_study_segments(study_id, study_result, limit)
+        return study_results
+
+    def _get_remaining_study_segments(self, study_id, study_result, limit):
+        """
+        Internal function. Given the first page of metadata for a study, fetch any further pages of
+        segments and add them to the channel groups in `study_result` in place.
+
+        Parameters
+        ----------
+        study_id : str
+            A unique ID identifying a study
+        study_result : dict
+            Study details with the first `limit` segments of each channel group
+        limit : int
+            Batch size for repeated API calls
+        """
+        max_segments_returned = total_segments_returned = max(
+            [len(channel_group['segments']) for channel_group in study_result['channelGroups']])
 
-                max_segments_returned = max(
-                    [len(channel_group['segments']) for channel_group in result['channelGroups']])
-                total_segments_returned += max_segments_returned
+        # If any channel groups have at least `limit` segments, paginate
+        # Can't use get_paginated_result() because need to paginate within a nested list
+        query_variables = {'study_id': study_id, 'offset': 0, 'limit': limit}
+        while max_segments_returned == limit:
+            query_variables['offset'] = total_segments_returned
+            result = self.execute_query(graphql.GET_STUDY_WITH_DATA,
+                                        variable_values=query_variables)['study']
 
-            full_result.append(study_result)
+            for i, channel_group in enumerate(result['channelGroups']):
+                if len(channel_group['segments']) > 0:
+                    study_result['channelGroups'][i]['segments'].extend(channel_group['segments'])
 
-        return {'studies': full_result}
+            max_segments_returned = max(
+                [len(channel_group['segments']) for channel_group in result['channelGroups']])
+            total_segments_returned += max_segments_returned
 
     def get_all_study_metadata_dataframe_by_names(self, study_names=None):
         """
@@ -1596,8 +1889,8 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
         return all_data
 
     # pylint:disable=too-many-locals,too-many-arguments
-    def get_channel_data(self, all_data, segment_urls=None, download_function=requests.get,
-                         threads=None, from_time=0, to_time=9e12, s3_urls=True):
+    def get_channel_data(self, all_data, segment_urls=None, download_function=None, threads=None,
+                         from_time=0, to_time=9e12, s3_urls=True):
         """
         Download raw data for all channel groups and segments listed in a given metadata DataFrame
         and return as a new DataFrame.
@@ -1612,10 +1905,11 @@ class SeerConnect:  # pylint: disable=too-many-public-methods
             as returned by `get_data_chunk_urls`. If None, these will be retrieved for each segment
             in `all_data`.
         download_function : callable, optional
-            The function used to download the channel data. Defaults to requests.get
+            The function used to download the channel data. If None (default), uses the `get`
+            method of a `requests.Session` shared between downloads.
         threads : int, optional
-            Number of threads to use. If > 1 will use multiprocessing. If None (default), will use
-            1 on Windows and 5 on Linux/MacOS.
+            Number of threads to download with. If None (default), uses
+            `utils.DEFAULT_DOWNLOAD_THREADS`.
         from_time : float, optional
             Timestamp in msec - only retrieve data from this point onward
         to_time : float, optional
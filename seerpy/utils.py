@@ -3,22 +3,162 @@ Utility and helper functions for downloading data, as well as plotting.
 
 Copyright 2017 Seer Medical Pty Ltd, Inc. or its affiliates. All Rights Reserved.
 """
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import functools
-import gzip
 import logging
+import threading
 import time
-from multiprocessing import Pool
-import os
 
 import numpy as np
 import pandas as pd
 import requests
+try:
+    # ISA-L's zlib-compatible module decompresses gzip several times faster, if it is installed
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_DOWNLOAD_THREADS = 16
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_HEADER_SIZE = 10
 
-# pylint:disable=too-many-locals,too-many-statements
-def download_channel_data(data_q, download_function):
+
+def create_session(pool_maxsize):
+    """
+    Create a `requests.Session` able to keep up to `pool_maxsize` connections per host open for
+    reuse, so that concurrent requests don't each need a new connection (and TLS handshake).
+
+    Parameters
+    ----------
+    pool_maxsize : int
+        The maximum number of connections to keep open to a single host
+
+    Returns
+    -------
+    session : requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_maxsize,
+                                            pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# a single session shared by all data chunk downloads, so HTTP connections (and their TLS
+# handshakes) are reused rather than re-established for every chunk
+SESSION = create_session(DEFAULT_DOWNLOAD_THREADS)
+
+
+class TTLCache:
+    """
+    A small thread-safe cache whose entries expire `ttl` seconds after being set. Once `maxsize`
+    entries are held, the least recently used entry is evicted. Values are deep-copied on the way
+    in and out, so callers are free to modify what they get back.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries to hold
+    ttl : float, optional
+        Number of seconds an entry remains valid for
+    """
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get a copy of the value for `key`, or `default` if it is missing or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """
+        Store a copy of `value` for `key`, evicting the least recently used entry if needed.
+        """
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SlidingWindowRateLimiter:  # pylint:disable=too-few-public-methods
+    """
+    A thread-safe rate limiter allowing at most `max_calls` calls in any `period` seconds. Calls
+    only block once `max_calls` have been made within the last `period` seconds, and then only
+    until the oldest of those falls out of the window.
+
+    Parameters
+    ----------
+    max_calls : int
+        Maximum number of calls allowed within any window of `period` seconds
+    period : float
+        Length of the sliding window in seconds
+    """
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        # start times of recent calls, oldest first. these can be in the future for calls which are
+        # still waiting for their turn
+        self._call_times = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Reserve a call, sleeping until it is allowed if necessary.
+
+        The call's start time is reserved before sleeping, which means concurrent callers queue up
+        fairly without holding the lock while they wait.
+
+        Returns
+        -------
+        wait_time : float
+            Number of seconds slept
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._call_times and self._call_times[0] <= now - self.period:
+                self._call_times.popleft()
+            start_time = now
+            if len(self._call_times) >= self.max_calls:
+                # wait until the call `max_calls` calls ago is out of the window
+                start_time = max(now, self._call_times[-self.max_calls] + self.period)
+            self._call_times.append(start_time)
+            wait_time = start_time - now
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+
+# pylint:disable=too-many-locals,too-many-statements,too-many-branches
+def download_channel_data(data_q, download_function, from_time=0, to_time=9e12):
     """
     Download data for a single segment, decompress if needed, convert to numeric type & apply
     exponentiation etc, and return as a DataFrame.
@@ -27,9 +167,9 @@ def download_channel_data(data_q, download_function):
     ----------
     data_q : list of list
         A list containing 5 elements:
-        - A row from a metadata DataFrame with fields including: a data chunk URL,
-        timestamp, sample encoding, sample rate, compression, signal min/max
-        exponent etc. See `get_channel_data` for series derivation
+        - A row from a metadata DataFrame (as a dict or pd.Series) with fields including: a
+        data chunk URL, timestamp, sample encoding, sample rate, compression, signal min/max
+        exponent etc. See `get_channel_data` for row derivation
         - study_id : str
         - channel_group_id : str
         - segment_id : str
@@ -37,22 +177,32 @@ def download_channel_data(data_q, download_function):
     download_function : callable
         A function that will be used to attempt to download data from the URL
         defined in data_q[0]['dataChunks.url']
+    from_time : float, optional
+        Timestamp in msec - only return data from this point onward
+    to_time : float, optional
+        Timestamp in msec - only return data up until this point
 
     Returns
     -------
-    data_df : pd.DataFrame
-        DataFrame with columns 'time', 'id', 'channelGroups.id', 'segments.id',
-        and a column with data for each channel in channel_names
+    data_df : pd.DataFrame or None
+        DataFrame with columns 'time' (float64), 'id', 'channelGroups.id', 'segments.id', and a
+        float32 column with data for each channel in channel_names, whatever the sample encoding.
+        None if the chunk could not be downloaded, or starts after the end of the requested time
+        range or of its segment
     """
     meta_data, study_id, channel_groups_id, segment_id, channel_names = data_q
     try:
+        end_time = min(meta_data['segments.startTime'] + meta_data['segments.duration'], to_time)
+        if meta_data['dataChunks.time'] >= end_time:
+            # none of the chunk's data would be returned, so don't download it at all
+            return None
+
         data = _get_data_chunk(study_id, meta_data, download_function)
         if data is None:
             return None
 
-        data_type = meta_data['channelGroups.sampleEncoding']
-        data = np.frombuffer(data, dtype=np.dtype(data_type))
-        data = data.astype(np.float32)
+        data_type = np.dtype(meta_data['channelGroups.sampleEncoding'])
+        data = np.frombuffer(data, dtype=data_type)
 
         column_names = channel_names
 
@@ -63,11 +213,11 @@ def download_channel_data(data_q, download_function):
             column_names = ['time'] + channel_names
             data = data.reshape(-1, len(column_names))
         else:
+            samples_per_record = int(meta_data['channelGroups.samplesPerRecord'])
             try:
                 # EDF data is in the format [record 1: (ch1 sample1, ch1 sample2, ..., ch1 sampleN),
                 # (ch2 sample1, ch2 sample2, ..., ch2 sampleN), ...][record2: ...], ..., [recordN: ...]
-                data = data.reshape(-1, len(channel_names),
-                                    int(meta_data['channelGroups.samplesPerRecord']))
+                data = data.reshape(-1, len(channel_names), samples_per_record)
             # We have a catch for 'ValueError' when calling 'reshape',
             # because it is a known issue with some EDF files that have a duration
             # not evenly divisible by 1000 (i.e. not whole seconds) that were processed
@@ -76,7 +226,6 @@ def download_channel_data(data_q, download_function):
             # of samples, so if we chop the empty record of samples off the end
             # all should be right with the world.
             except ValueError:
-                samples_per_record = int(meta_data['channelGroups.samplesPerRecord'])
                 # For segments affected by the seer-worker bug mentioned above
                 # that also had a sample count that didn't divide evenly
                 # into the samplesPerRecord attribute, the logic that fills in
@@ -87,70 +236,96 @@ def download_channel_data(data_q, download_function):
                 # that don't divide evenly into samples_per_record are likely due
                 # to the known bug and can be safely pruned.
                 excess_samples = (len(data) % samples_per_record) + samples_per_record
-                data = data[:-excess_samples].reshape(
-                    -1, len(channel_names), int(meta_data['channelGroups.samplesPerRecord']))
+                data = data[:-excess_samples].reshape(-1, len(channel_names), samples_per_record)
 
+            # view the samples in (record, sample, channel) order. they are not copied into a row
+            # per sample here, as that happens anyway when converting them to floats below
             data = np.transpose(data, (0, 2, 1))
-            data = data.reshape(-1, data.shape[2])
 
-        if 'int' in data_type:
-            # EDF int format data encodes missing values as the minimum possible int value
+        # the exponent scales channel values (but not timestamps) into the units returned
+        scale = np.full(len(column_names), 10.0**float(meta_data['channelGroups.exponent']))
+        if meta_data['channelGroups.timestamped']:
+            scale[0] = 1.
 
-            # first remove any minimum ints at the end of the data
-            nan_mask = np.all(data == np.iinfo(np.dtype(data_type)).min, axis=1)
-            if nan_mask[-1]:
-                nan_mask_corrected = np.ones(nan_mask.shape, dtype=bool)
-                for i in range(len(nan_mask) - 1, -1, -1):
-                    if nan_mask[i]:
-                        nan_mask_corrected[i] = False
-                    else:
-                        break
-                data = data[nan_mask_corrected]
+        if np.issubdtype(data_type, np.integer):
+            # EDF int format data encodes missing values as the minimum possible int value
 
-            # now convert any internal minimum ints into nans
-            data[np.all(data == np.iinfo(np.dtype(data_type)).min, axis=1), :] = np.nan
+            int_info = np.iinfo(data_type)
+            dig_min = int_info.min
+            dig_max = int_info.max
+            nan_mask = np.all(data == dig_min, axis=-1).reshape(-1)
 
             # this converts the int values which are in a range between minimum int and maximum int,
-            # into float values in a range between signalMin and signalMax
-            chan_min = meta_data['channelGroups.signalMin'].astype(np.float64)
-            chan_max = meta_data['channelGroups.signalMax'].astype(np.float64)
+            # into float values in a range between signalMin and signalMax. the conversion and the
+            # exponent are folded into one scale and offset per column, so the float values are
+            # computed in a single pass straight from the int data
+            chan_min = float(meta_data['channelGroups.signalMin'])
+            chan_max = float(meta_data['channelGroups.signalMax'])
             chan_diff = chan_max - chan_min
-            dig_min = np.iinfo(data_type).min
-            dig_max = np.iinfo(data_type).max
             dig_diff = abs(dig_min) + abs(dig_max)
 
             with np.errstate(divide='ignore', invalid='ignore'):
-                data = (data - dig_min) / dig_diff * chan_diff + chan_min
+                # the scale and offset stay float64, so large offsets don't lose precision. numpy
+                # computes each product and sum in float64 (in small buffered blocks) and only
+                # rounds the result to the float32 output, so no full float64 copy of the data is
+                # made
+                offset = (chan_min - dig_min * chan_diff / dig_diff) * scale
+                scale = scale * chan_diff / dig_diff
+                values = np.empty(data.shape, dtype=np.float32)
+                np.multiply(data, scale, out=values, casting='unsafe')
+                np.add(values, offset, out=values, casting='unsafe')
+            values = values.reshape(-1, len(column_names))
 
-        data = pd.DataFrame(data=data, index=None, columns=column_names)
+            # first remove any minimum ints at the end of the data
+            if nan_mask.size and nan_mask[-1]:
+                # the trailing run ends just after the last row which is not all minimum ints
+                keep = 0 if nan_mask.all() else nan_mask.size - int(np.argmax(~nan_mask[::-1]))
+                values = values[:keep]
+                nan_mask = nan_mask[:keep]
 
-        exponent = meta_data['channelGroups.exponent'].astype(np.float64)
-        data[channel_names] = data[channel_names] * 10.0**exponent
+            # now convert any internal minimum ints into nans
+            values[nan_mask, :] = np.nan
+        else:
+            values = np.empty(data.shape, dtype=np.float32)
+            np.multiply(data, scale.astype(np.float32), out=values)
+            values = values.reshape(-1, len(column_names))
 
-        data = data.fillna(method='ffill', axis='columns')
-        data = data.fillna(method='bfill', axis='columns')
-        data = data.fillna(value=0., axis='columns')
+        _fill_missing_values(values)
 
         if meta_data['channelGroups.timestamped']:
             # data timestamp is relative to chunk start
             # make sure both are float64 - sometimes mixed float arithmetic gives strange results
-            data['time'] = (data['time'].astype(np.float64)
-                            + meta_data['dataChunks.time'].astype(np.float64))
+            time_values = values[:, 0].astype(np.float64) + np.float64(meta_data['dataChunks.time'])
+            values = values[:, 1:]
         else:
-            data['time'] = (np.arange(data.shape[0]) *
-                            (1000.0 / meta_data['channelGroups.sampleRate'])
-                            + meta_data['dataChunks.time'])
-
-        data['id'] = study_id
-        data['channelGroups.id'] = channel_groups_id
-        data['segments.id'] = segment_id
-        data = data[['time', 'id', 'channelGroups.id', 'segments.id'] + channel_names]
+            time_values = (np.arange(values.shape[0]) *
+                           (1000.0 / meta_data['channelGroups.sampleRate'])
+                           + meta_data['dataChunks.time'])
 
         # chunks are all the same size for a given channel group (usually 10s)
         # if they don't contain that much data they are padded out
-        # this discards any padding at the end of a segment before the data is returned
-        segment_end = meta_data['segments.startTime'] + meta_data['segments.duration']
-        data = data[data['time'] < segment_end]
+        # this discards any padding at the end of a segment, along with anything outside the
+        # requested time range, before the data is returned
+        if meta_data['channelGroups.timestamped']:
+            in_range = (time_values >= from_time) & (time_values < end_time)
+            if not in_range.all():
+                # only pay for a filtered copy if there is actually data to discard
+                time_values = time_values[in_range]
+                values = values[in_range]
+        else:
+            # EDF sample times are evenly spaced, so the data in range can be found by bisection and
+            # sliced out rather than masked
+            start, end = np.searchsorted(time_values, [from_time, end_time], side='left')
+            time_values = time_values[start:end]
+            values = values[start:end]
+
+        # build the frame around the channel values and insert the remaining columns in front,
+        # rather than appending them and then copying the whole frame to reorder its columns
+        data = pd.DataFrame(data=values, index=None, columns=channel_names)
+        data.insert(0, 'segments.id', segment_id)
+        data.insert(0, 'channelGroups.id', channel_groups_id)
+        data.insert(0, 'id', study_id)
+        data.insert(0, 'time', time_values)
 
         return data
 
@@ -161,6 +336,49 @@ def download_channel_data(data_q, download_function):
         raise
 
 
+def _fill_missing_values(values):
+    """
+    Internal function. Fill NaNs in a 2-D array of channel data in place, row by row: from the
+    nearest preceding value in the same row, otherwise from the nearest following value, otherwise
+    (for rows with no values at all) with 0. This matches calling `fillna` with `method='ffill'`,
+    `method='bfill'` and then `value=0.` along the columns of a DataFrame, without pandas' slow
+    row-wise path. Only rows which actually have gaps are copied and filled.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        2-D float array with a row per sample and a column per channel
+    """
+    missing = np.isnan(values)
+    rows_with_gaps = missing.any(axis=1)
+    if not rows_with_gaps.any():
+        return
+
+    # rows with no values at all (e.g. missing EDF records) just become 0
+    empty_rows = missing.all(axis=1)
+    values[empty_rows] = 0.
+    rows_with_gaps &= ~empty_rows
+    if not rows_with_gaps.any():
+        return
+
+    # only rows with some values missing need filling from their neighbours
+    gaps = values[rows_with_gaps]
+    missing = missing[rows_with_gaps]
+    num_columns = gaps.shape[1]
+    column_index = np.arange(num_columns)
+    rows = np.arange(gaps.shape[0])[:, np.newaxis]
+    # for each cell, the column of the nearest value at or before it
+    previous_column = np.maximum.accumulate(np.where(missing, 0, column_index), axis=1)
+    gaps = gaps[rows, previous_column]
+    # anything still missing has no value before it, so take the nearest one after it
+    missing = np.isnan(gaps)
+    if missing.any():
+        next_column = np.minimum.accumulate(
+            np.where(missing, num_columns - 1, column_index)[:, ::-1], axis=1)[:, ::-1]
+        gaps = gaps[rows, next_column]
+    values[rows_with_gaps] = gaps
+
+
 def _get_data_chunk(study_id, meta_data, download_function):
     """
     Internal function. Download a single chunk of data and decompress if needed. If the supplied
@@ -171,10 +389,10 @@ def _get_data_chunk(study_id, meta_data, download_function):
     ----------
     study_id : str
         The id of the study the data chunk belongs to
-    meta_data : Dataframe
-        A metadata DataFrame with fields including: a data chunk URL, timestamp, sample encoding,
-        sample rate, compression, signal min/max, exponent etc. See `get_channel_data` for series
-        derivation
+    meta_data : dict or pd.Series
+        A row from a metadata DataFrame with fields including: a data chunk URL, timestamp, sample
+        encoding, sample rate, compression, signal min/max, exponent etc. See `get_channel_data` for
+        row derivation
     download_function : callable
         A function that will be used to download data from the URL in meta_data['dataChunks.url']
 
@@ -187,7 +405,6 @@ def _get_data_chunk(study_id, meta_data, download_function):
     max_attempts = 3
     for i in range(max_attempts):
         response = download_function(meta_data['dataChunks.url'])
-        data = response.content
 
         try:
             status_code = response.status_code
@@ -202,8 +419,8 @@ def _get_data_chunk(study_id, meta_data, download_function):
             break
 
         logger.warning(f"download_channel_data(): {status_code} status code returned: {reason}\n"
-                       f"response content {data}\nstudy_id: {study_id}\ndataChunks.url: "
-                       f"{meta_data['dataChunks.url']}\ndataChunks.time: "
+                       f"response content {response.content}\nstudy_id: {study_id}\n"
+                       f"dataChunks.url: {meta_data['dataChunks.url']}\ndataChunks.time: "
                        f"{meta_data['dataChunks.time']:.2f}\nmeta_data: {meta_data}")
 
         if status_code == 404:
@@ -224,13 +441,69 @@ def _get_data_chunk(study_id, meta_data, download_function):
         # throw an error for other status codes
         raise requests.exceptions.HTTPError(f'HTTPError {status_code}')
 
+    if meta_data['channelGroups.compression'] != 'gzip':
+        return response.content
+
     try:
-        if meta_data['channelGroups.compression'] == 'gzip':
-            data = gzip.decompress(data)
-    except OSError:
-        pass
+        # decompress the body as it arrives (if the response is streamed), rather than holding the
+        # whole compressed body in memory first
+        chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+    except AttributeError:
+        chunks = [response.content]  # the download function used does not return a Response
+    return _gzip_decompress(chunks)
 
-    return data
+
+def _gzip_decompress(chunks):
+    """
+    Internal function. Decompress gzipped data one piece at a time with zlib (or ISA-L, if the
+    optional `isal` package is installed), rather than through the buffered file-like reader
+    `gzip.decompress` uses on older Pythons. Handles concatenated gzip members, and returns the data
+    unchanged if it is not gzipped (e.g. if the server has already decoded it).
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Consecutive pieces of possibly gzipped data
+
+    Returns
+    -------
+    data : bytes
+        The decompressed data
+    """
+    chunks = iter(chunks)
+    # buffer at least a gzip header's worth of data before deciding whether the data is gzipped, as
+    # not every zlib backend rejects a non-gzip prefix that is shorter than the header
+    first_chunk = b''
+    for chunk in chunks:
+        first_chunk += chunk
+        if len(first_chunk) >= GZIP_HEADER_SIZE:
+            break
+    if not first_chunk:
+        return b''
+    if not first_chunk.startswith(GZIP_MAGIC):
+        return first_chunk + b''.join(chunks)
+
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)  # | 16 expects a gzip header
+    try:
+        decompressed = [decompressor.decompress(first_chunk)]
+    except zlib.error:
+        return first_chunk + b''.join(chunks)
+
+    pending = decompressor.unused_data
+    while True:
+        while pending:
+            if decompressor.eof:
+                # the start of another gzip member
+                decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            decompressed.append(decompressor.decompress(pending))
+            pending = decompressor.unused_data
+        pending = next(chunks, None)
+        if pending is None:
+            break
+
+    if not decompressor.eof:
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+    return b''.join(decompressed)
 
 
 # pylint:disable=too-many-locals
@@ -257,37 +530,58 @@ def create_data_chunk_urls(metadata, segment_urls, from_time=0, to_time=9e12):
         which can be used to download data chunks in a segment
     """
     chunk_pattern = '00000000000.dat'
-
-    data_chunks = []
-    metadata = metadata.drop_duplicates('segments.id').reset_index(drop=True)
-    for index in range(len(metadata.index)):
-        row = metadata.iloc[index]
-
-        seg_base_urls = segment_urls.loc[segment_urls['segments.id'] == row['segments.id'],
-                                         'baseDataChunkUrl']
-        if seg_base_urls.empty:
-            continue
-        seg_base_url = seg_base_urls.iloc[0]
-
-        chunk_period = row['channelGroups.chunkPeriod']
-        num_chunks = int(np.ceil(row['segments.duration'] / chunk_period / 1000.))
-        start_time = row['segments.startTime']
-
-        for i in range(num_chunks):
-            chunk_start_time = chunk_period * 1000 * i + start_time
-            next_chunk_start_time = chunk_period * 1000 * (i + 1) + start_time
-            if chunk_start_time < to_time and next_chunk_start_time > from_time:
-                data_chunk_name = str(i).zfill(len(chunk_pattern) - 4) + chunk_pattern[-4:]
-                data_chunk_url = seg_base_url.replace(chunk_pattern, data_chunk_name)
-                data_chunk = [row['segments.id'], data_chunk_url, chunk_start_time]
-                data_chunks.append(data_chunk)
-
-    return pd.DataFrame.from_records(data_chunks,
-                                     columns=['segments.id', 'dataChunks.url', 'dataChunks.time'])
-
-
-# pylint:disable=too-many-locals,too-many-arguments
-def get_channel_data(study_metadata, segment_urls, download_function=requests.get, threads=None,
+    columns = ['segments.id', 'dataChunks.url', 'dataChunks.time']
+
+    metadata = metadata.drop_duplicates('segments.id')
+    # look up each segment's base URL once, keeping the first URL listed for a segment
+    base_urls = segment_urls.drop_duplicates('segments.id').set_index(
+        'segments.id')['baseDataChunkUrl']
+    seg_base_urls = metadata['segments.id'].map(base_urls)
+    has_url = seg_base_urls.notna().values
+    if not has_url.any():
+        return pd.DataFrame(columns=columns)
+
+    segment_ids = metadata['segments.id'].values[has_url]
+    seg_base_urls = seg_base_urls.values[has_url]
+    chunk_periods = metadata['channelGroups.chunkPeriod'].values[has_url]
+    start_times = metadata['segments.startTime'].values[has_url]
+    num_chunks = np.ceil(metadata['segments.duration'].values[has_url] / chunk_periods
+                         / 1000.).astype(np.int64)
+
+    # build every (segment, chunk index) pair at once, rather than looping over each chunk of each
+    # segment in Python
+    segment_index = np.repeat(np.arange(len(segment_ids)), num_chunks)
+    chunk_index = np.arange(segment_index.size) - np.repeat(np.cumsum(num_chunks) - num_chunks,
+                                                            num_chunks)
+    chunk_periods = chunk_periods[segment_index] * 1000
+    start_times = start_times[segment_index]
+    chunk_start_times = chunk_periods * chunk_index + start_times
+    next_chunk_start_times = chunk_periods * (chunk_index + 1) + start_times
+
+    in_range = (chunk_start_times < to_time) & (next_chunk_start_times > from_time)
+    if not in_range.any():
+        return pd.DataFrame(columns=columns)
+    segment_index = segment_index[in_range]
+    chunk_index = chunk_index[in_range]
+
+    # split each segment's base URL around the chunk file name once, rather than searching every
+    # chunk's copy of the URL for it
+    url_parts = [seg_base_url.partition(chunk_pattern) for seg_base_url in seg_base_urls]
+    data_chunk_urls = [
+        f'{head}{i:011d}.dat{tail}' if pattern else head
+        for (head, pattern, tail), i in zip((url_parts[j] for j in segment_index.tolist()),
+                                            chunk_index.tolist())
+    ]
+
+    return pd.DataFrame({
+        'segments.id': segment_ids[segment_index],
+        'dataChunks.url': data_chunk_urls,
+        'dataChunks.time': chunk_start_times[in_range]
+    })
+
+
+# pylint:disable=too-many-locals,too-many-arguments,too-many-branches
+def get_channel_data(study_metadata, segment_urls, download_function=None, threads=None,
                      from_time=0, to_time=9e12):
     """
     Download data chunks and stitch together into a single DataFrame.
@@ -300,11 +594,11 @@ def get_channel_data(study_metadata, segment_urls, download_function=requests.ge
         DataFrame with columns ['segments.id', 'baseDataChunkUrl'] as returned by
         `seerpy.get_segment_urls`, or with columns ['segments.id', 'dataChunks.time',
         'dataChunks.url'] as returned by `seerpy.get_data_chunk_urls`.
-    download_function : callable
-        The function used to download the channel data. Defaults to requests.get
+    download_function : callable, optional
+        The function used to download the channel data. If None (default), uses the `get` method of
+        a `requests.Session` shared between downloads, with responses streamed
     threads : int, optional
-        Number of threads to use. If > 1 then will use multiprocessing. If None (default), it will
-        use 1 on Windows and 5 on Linux/MacOS
+        Number of threads to download with. If None (default), uses `DEFAULT_DOWNLOAD_THREADS`
     from_time : float, optional
         Timestamp in msec - only retrieve data from this point onward
     to_time : float, optional
@@ -315,27 +609,43 @@ def get_channel_data(study_metadata, segment_urls, download_function=requests.ge
     data_df : pd.DataFrame
         DataFrame containing study ID, channel group IDs, semgment IDs, time, and raw data
     """
+    if download_function is None:
+        # stream responses so they can be decompressed as they arrive, see `_get_data_chunk()`
+        download_function = functools.partial(SESSION.get, stream=True)
     if threads is None:
-        threads = 1 if os.name == 'nt' else 5
+        threads = DEFAULT_DOWNLOAD_THREADS
+
+    # de-duplicate segments once here, so neither create_data_chunk_urls nor the merge below has to
+    # hash the full (per channel) metadata again
+    segment_metadata = study_metadata.drop_duplicates('segments.id')
 
     data_chunk_urls = segment_urls
     if 'baseDataChunkUrl' in data_chunk_urls.columns:
-        data_chunk_urls = create_data_chunk_urls(study_metadata, data_chunk_urls, from_time,
+        data_chunk_urls = create_data_chunk_urls(segment_metadata, data_chunk_urls, from_time,
                                                  to_time)
 
-    data_q = []
+    # join every segment to its data chunks in one merge, rather than merging each segment against
+    # the full data chunk table
+    chunk_metadata = segment_metadata.merge(data_chunk_urls, how='left', on='segments.id',
+                                            suffixes=('', '_y'))
+    chunk_metadata = chunk_metadata.dropna(axis=0, how='any', subset=['dataChunks.url'])
+
+    # every segment of a channel group has the group's channels, so work out the channel names once
+    # per channel group, rather than once per segment
+    channel_metadata = study_metadata[study_metadata['channelGroups.id'].isin(
+        chunk_metadata['channelGroups.id'])].drop_duplicates(['channelGroups.id', 'channels.id'])
+    channel_names = {
+        channel_groups_id: get_channel_names_or_ids(metadata)
+        for channel_groups_id, metadata in channel_metadata.groupby('channelGroups.id', sort=False)
+    }
 
-    segment_ids = study_metadata['segments.id'].drop_duplicates().tolist()
-    for segment_id in segment_ids:
-        metadata = study_metadata[study_metadata['segments.id'].values == segment_id]
-        actual_channel_names = get_channel_names_or_ids(metadata)
-        metadata = metadata.drop_duplicates('segments.id')
+    data_q = []
 
+    # sort=False keeps segments in the order they appear in the metadata
+    for segment_id, metadata in chunk_metadata.groupby('segments.id', sort=False):
         study_id = metadata['id'].iloc[0]
         channel_groups_id = metadata['channelGroups.id'].iloc[0]
-
-        metadata = metadata.merge(data_chunk_urls, how='left', left_on='segments.id',
-                                  right_on='segments.id', suffixes=('', '_y'))
+        actual_channel_names = channel_names[channel_groups_id]
 
         metadata = metadata[[
             'dataChunks.url', 'dataChunks.time', 'segments.startTime', 'segments.duration',
@@ -345,37 +655,75 @@ def get_channel_data(study_metadata, segment_urls, download_function=requests.ge
             'channelGroups.exponent', 'channelGroups.timestamped'
         ]]
         metadata = metadata.drop_duplicates()
-        metadata = metadata.dropna(axis=0, how='any', subset=['dataChunks.url'])
-        for i in range(len(metadata.index)):
-            data_q.append(
-                [metadata.iloc[i], study_id, channel_groups_id, segment_id, actual_channel_names])
+        # to_dict avoids building a new Series (with dtype inference) for every row
+        for row in metadata.to_dict('records'):
+            data_q.append([row, study_id, channel_groups_id, segment_id, actual_channel_names])
 
     download_function = functools.partial(download_channel_data,
-                                          download_function=download_function)
+                                          download_function=download_function,
+                                          from_time=from_time, to_time=to_time)
     data_list = []
     if data_q:
-        if threads > 1:
-            pool = Pool(processes=min(threads, len(data_q) + 1))
-            data_list = list(pool.map(download_function, data_q))
-            pool.close()
-            pool.join()
+        if threads > 1 and len(data_q) > 1:
+            # downloading is I/O-bound, so threads avoid the process start-up and pickling costs of
+            # a process pool
+            with ThreadPoolExecutor(max_workers=min(threads, len(data_q))) as executor:
+                data_list = list(executor.map(download_function, data_q))
         else:
+            # a single chunk (or thread) gains nothing from starting a pool
             data_list = [download_function(data_q_item) for data_q_item in data_q]
 
+    if data_list:
+        # concatenate chunks in the order the data is returned in, so the result is usually already
+        # sorted and doesn't need to be sorted again below. columns keep the order they first
+        # appear in the metadata. chunks which weren't downloaded (None) are dropped
+        columns = list(dict.fromkeys(
+            column for chunk_data in data_list if chunk_data is not None
+            for column in chunk_data.columns))
+        order = sorted(range(len(data_q)),
+                       key=lambda i: (data_q[i][1], data_q[i][2], data_q[i][0]['dataChunks.time']))
+        data_list = [data_list[i] for i in order if data_list[i] is not None]
+
     if data_list:
         # sort=False to silence deprecation warning. This comes into play when we are processing
         # segments across multiple channel groups which have different channels.
-        data = pd.concat(data_list, sort=False)
-        data = data.loc[(data['time'] >= from_time) & (data['time'] < to_time)]
-        data = data.sort_values(['id', 'channelGroups.id', 'time'], axis=0, ascending=True,
-                                na_position='last')
-        data = data.reset_index(drop=True)
+        data = pd.concat(data_list, sort=False, ignore_index=True)
+        if data.columns.tolist() != columns:
+            data = data[columns]
+        if not _is_sorted_by_time(data):
+            # e.g. overlapping segments. sort in place and renumber the index in the same pass,
+            # rather than allocating a sorted copy and then a re-indexed copy of the full frame
+            data.sort_values(['id', 'channelGroups.id', 'time'], axis=0, ascending=True,
+                             na_position='last', inplace=True, ignore_index=True)
     else:
         data = pd.DataFrame()
 
     return data
 
 
+def _is_sorted_by_time(data):
+    """
+    Internal function. Check whether channel data with rows grouped by 'id' and 'channelGroups.id'
+    (in sorted order) is also sorted by 'time' within each group. This is a single linear pass, far
+    cheaper than sorting data that is already in order.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Channel data with 'id', 'channelGroups.id' and 'time' columns
+
+    Returns
+    -------
+    is_sorted : bool
+    """
+    study_ids = data['id'].to_numpy()
+    channel_group_ids = data['channelGroups.id'].to_numpy()
+    times = data['time'].to_numpy()
+    same_group = ((study_ids[1:] == study_ids[:-1])
+                  & (channel_group_ids[1:] == channel_group_ids[:-1]))
+    return not np.any(same_group & (times[1:] < times[:-1]))
+
+
 def get_channel_names_or_ids(metadata):
     """
     Get a list of unique channel names, using ID instead if a name is null or duplicated.
@@ -390,17 +738,11 @@ def get_channel_names_or_ids(metadata):
     actual_channel_names : list of str
         Unique channels names or IDs.
     """
-    actual_channel_names = []
     unique_ids = metadata.drop_duplicates(subset='channels.id')
-    name_value_counts = unique_ids['channels.name'].value_counts()
-    for index in range(len(unique_ids.index)):
-        row = unique_ids.iloc[index]
-        channel_name = row['channels.name']
-        if not channel_name or name_value_counts[channel_name] > 1:
-            actual_channel_names.append(row['channels.id'])
-        else:
-            actual_channel_names.append(channel_name)
-    return actual_channel_names
+    names = unique_ids['channels.name']
+    name_counts = names.map(names.value_counts())
+    use_name = names.notna() & names.astype(bool) & (name_counts == 1)
+    return names.where(use_name, unique_ids['channels.id']).tolist()
 
 
 # pylint:disable=too-many-locals
@@ -450,13 +792,11 @@ def plot_eeg(x, y=None, pred=None, squeeze=5.0, scaling_factor=None):
         x = x.reshape(-1, 1)
 
     channels = x.shape[1]
-    x = np.flip(x, axis=1)
     has_pred = 1 if pred is not None else 0
     grid_spec = gridspec.GridSpec(2, 1, height_ratios=[channels, 1])
     ticks = np.arange(x.shape[0]).astype(np.float32)
     fig = plt.figure(figsize=(14, (channels + has_pred) * 2))
     fig.tight_layout()
-    ticklocs = []
     ax2 = fig.add_subplot(grid_spec[0])
     if scaling_factor is None:
         scaling_factor = np.nanmedian(np.abs(x)) * squeeze  # Crowd them a bit.
@@ -465,13 +805,13 @@ def plot_eeg(x, y=None, pred=None, squeeze=5.0, scaling_factor=None):
     ax2.set_ylim(y_bottom, y_top)
     ax2.set_xlim(ticks.min(), ticks.max())
 
-    segs = []
-    for i in range(channels):
-        segs.append(np.hstack((ticks[:, np.newaxis], x[:, i, np.newaxis])))
-        ticklocs.append(i * scaling_factor)
+    # build the (time, value) line for every channel in one array, with the first channel at the top
+    segs = np.empty((channels, x.shape[0], 2), dtype=np.result_type(ticks, x))
+    segs[:, :, 0] = ticks
+    segs[:, :, 1] = x.T[::-1]
 
     offsets = np.zeros((channels, 2), dtype=float)
-    offsets[:, 1] = ticklocs
+    offsets[:, 1] = np.arange(channels) * scaling_factor
 
     lines = LineCollection(segs, offsets=offsets, transOffset=None, linewidths=(0.5))
     ax2.add_collection(lines)
@@ -589,9 +929,12 @@ def get_nested_dict_item(input_dict, keys, allow_missing_keys=False, default=Non
     ----------
     Based on this code: https://stackoverflow.com/a/46890853
     """
+    # a plain loop, rather than functools.reduce, avoids a lambda call for every key
+    item = input_dict
     if allow_missing_keys:
-        return functools.reduce(
-            lambda d, key: d.get(key, default)
-            if isinstance(d, dict) else default, keys, input_dict)
+        for key in keys:
+            item = item.get(key, default) if isinstance(item, dict) else default
     else:
-        return functools.reduce(lambda d, key: d[key], keys, input_dict)
+        for key in keys:
+            item = item[key]
+    return item
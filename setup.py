@@ -25,6 +25,6 @@ setup(
         "pyjwt[crypto]",
         "urllib3<1.27.0",
     ],
-    extras_require={"viz": ["matplotlib"]},
+    extras_require={"viz": ["matplotlib"], "fast": ["isal"]},
     tests_require=["pytest"],
 )
@@ -1,6 +1,7 @@
 from gql import gql
 
 import seerpy.graphql as graphql
+from seerpy.seerpy import parse_query
 
 
 def test_graphql_query_string():
@@ -11,6 +12,7 @@ def test_graphql_query_string():
     # the main advantage being we wouldn't miss any then.
 
     gql(graphql.GET_STUDY_WITH_DATA)
+    gql(graphql.get_studies_with_data_query_string(3))
     gql(graphql.GET_LABELS_PAGED)
     gql(graphql.GET_LABELS_STRING)
     gql(graphql.GET_ALL_LABEL_GROUPS_FOR_STUDY_ID_PAGED)
@@ -31,3 +33,17 @@ def test_graphql_query_string():
     gql(graphql.GET_STUDY_IDS_IN_STUDY_COHORT_PAGED)
     gql(graphql.GET_MOOD_SURVEY_RESULTS_PAGED)
     gql(graphql.GET_USER_IDS_IN_USER_COHORT_PAGED)
+
+
+def test_parse_query_is_cached():
+    """Ensure repeated constant query strings are only parsed once."""
+    query_string = graphql.GET_LABELS_PAGED
+
+    assert parse_query(query_string) is parse_query(query_string)
+
+
+def test_parse_query_generated_is_not_cached():
+    """Ensure generated query strings are not kept alive by the cache."""
+    query_string = graphql.get_segment_urls_query_string(['segment-1', 'segment-2'])
+
+    assert parse_query(query_string) is not parse_query(query_string)
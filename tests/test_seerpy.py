@@ -8,7 +8,7 @@ import pytest
 import pandas as pd
 
 from seerpy import auth
-from seerpy.seerpy import SeerConnect
+from seerpy.seerpy import SeerConnect, SessionRequestsHTTPTransport
 import seerpy.graphql as graphql
 
 from tests.test_data import (
@@ -45,6 +45,12 @@ class TestSeerConnect:
 
         assert result.graphql_client
 
+    def test_rate_limit(self):
+        result = SeerConnect(seer_auth=auth.BaseAuth(api_url=''))
+
+        assert result.rate_limiter.max_calls == result.api_limit
+        assert result.rate_limiter.period == result.api_limit_expire
+
     @mock.patch.object(auth, 'get_auth', autospec=True)
     def test_login_error(self, get_auth):
         get_auth.side_effect = InterruptedError('Authentication Failed')
@@ -53,6 +59,24 @@ class TestSeerConnect:
             SeerConnect()
 
 
+class TestSessionRequestsHTTPTransport:
+    def test_reuses_shared_session(self):
+        # setup
+        session = mock.Mock()
+        transport = SessionRequestsHTTPTransport(session=session, url='.')
+
+        # run test
+        transport.connect()
+        connected_session = transport.session
+        transport.close()
+        transport.connect()
+
+        # check result
+        assert connected_session is session
+        assert transport.session is session
+        session.close.assert_not_called()
+
+
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
 class TestPassingQueryVariables:
@@ -74,6 +98,118 @@ class TestPassingQueryVariables:
         assert gql_client.return_value.execute.call_args[1]['variable_values'] == {'a': 'b'}
 
 
+@mock.patch('time.sleep', return_value=None)
+@mock.patch('seerpy.seerpy.GQLClient', autospec=True)
+class TestExecuteQuery:
+    def test_retry_returns_response(self, gql_client, unused_sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = [
+            Exception('429 Client Error'),
+            Exception('502 Server Error'), {
+                'test': []
+            }
+        ]
+
+        result = seer_connect.execute_query("query Q { test { id } }")
+
+        assert result == {'test': []}
+        assert gql_client.return_value.execute.call_count == 3
+
+    def test_backoff_increases(self, gql_client, sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = [Exception('503 Server Error')] * 3 + [None]
+
+        seer_connect.execute_query("query Q { test { id } }")
+
+        sleep_times = [call[0][0] for call in sleep.call_args_list]
+        assert len(sleep_times) == 3
+        for i, sleep_time in enumerate(sleep_times):
+            assert 2**i <= sleep_time <= 2**i + 1
+
+    def test_too_many_failures(self, gql_client, unused_sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = Exception('503 Server Error')
+
+        with pytest.raises(Exception, match='503 Server Error'):
+            seer_connect.execute_query("query Q { test { id } }")
+
+        assert gql_client.return_value.execute.call_count == 6
+
+    def test_cached_query(self, gql_client, unused_sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = [{'test': [1]}, {'test': [2]}]
+
+        first_result = seer_connect.execute_cached_query("query Q { test { id } }")
+        second_result = seer_connect.execute_cached_query("query Q { test { id } }")
+
+        assert first_result == second_result == {'test': [1]}
+        assert gql_client.return_value.execute.call_count == 1
+
+    def test_mutation_clears_cache(self, gql_client, unused_sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = [{'test': [1]}, None, {'test': [2]}]
+
+        seer_connect.execute_cached_query("query Q { test { id } }")
+        seer_connect.execute_query("mutation M { test { id } }")
+        result = seer_connect.execute_cached_query("query Q { test { id } }")
+
+        assert result == {'test': [2]}
+        assert gql_client.return_value.execute.call_count == 3
+
+    def test_unresolvable_error(self, gql_client, unused_sleep, seer_connect):
+        gql_client.return_value.execute.side_effect = ValueError('Bad query')
+
+        with pytest.raises(ValueError):
+            seer_connect.execute_query("query Q { test { id } }")
+
+        assert gql_client.return_value.execute.call_count == 1
+
+
+@mock.patch('time.sleep', return_value=None)
+@mock.patch('seerpy.seerpy.GQLClient', autospec=True)
+class TestGetPaginatedResponse:
+    def test_nested_pages(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        gql_client.return_value.execute.side_effect = [
+            {'study': {'id': 'study-1', 'labels': [{'id': 'label-1'}, {'id': 'label-2'}]}},
+            {'study': {'id': 'study-1', 'labels': [{'id': 'label-3'}]}},
+            {'study': {'id': 'study-1', 'labels': []}},
+        ]
+
+        # run test
+        result = seer_connect.get_paginated_response("query Q { study { labels } }", {}, 2,
+                                                     ['study'], ['labels'])
+
+        # check result
+        assert result == {
+            'id': 'study-1',
+            'labels': [{'id': 'label-1'}, {'id': 'label-2'}, {'id': 'label-3'}]
+        }
+        assert gql_client.return_value.execute.call_count == 3
+
+    def test_empty_first_page(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        gql_client.return_value.execute.return_value = {'study': {'id': 'study-1', 'labels': []}}
+
+        # run test
+        result = seer_connect.get_paginated_response("query Q { study { labels } }", {}, 2,
+                                                     ['study'], ['labels'])
+
+        # check result
+        assert result == {'id': 'study-1', 'labels': []}
+        assert gql_client.return_value.execute.call_count == 1
+
+    def test_iter_max_items(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        gql_client.return_value.execute.side_effect = [
+            {'studies': [{'id': 'study-1'}, {'id': 'study-2'}]},
+            {'studies': [{'id': 'study-3'}]},
+        ]
+
+        # run test
+        result = list(seer_connect.iter_paginated_response("query Q { studies }", {}, 2,
+                                                           ['studies'], max_items=3))
+
+        # check result
+        assert result == [[{'id': 'study-1'}, {'id': 'study-2'}], [{'id': 'study-3'}]]
+        assert gql_client.return_value.execute.call_count == 2
+
+
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
 class TestPaginatedQuery:
@@ -301,6 +437,125 @@ class TestGetAllStudyMetaDataDataframeByIds:
         # check result
         pd.testing.assert_frame_equal(result, expected_result)
 
+    def test_channel_group_order(self, get_all_metadata, seer_connect):
+        # setup
+        studies = []
+        for i in range(1, 5):
+            filename = "study" + str(i) + "_metadata.json"
+            with open(TEST_DATA_DIR / filename, "r") as f:
+                study = json.load(f)['study']
+            # channel groups not sorted by id
+            study['channelGroups'] = study['channelGroups'][::-1]
+            studies.append(study)
+
+        get_all_metadata.return_value = {'studies': studies}
+
+        # run test
+        result = seer_connect.get_all_study_metadata_dataframe_by_ids()
+
+        # check result
+        # rows keep the order the channel groups are returned in
+        expected_order = [
+            channel_group['id'] for study in studies for channel_group in study['channelGroups']
+        ]
+        assert result['channelGroups.id'].drop_duplicates().tolist() == expected_order
+
+
+class TestPandasFlatten:
+    def test_success(self):
+        # setup
+        parent = pd.DataFrame({
+            'top.id': ['A', 'B', 'C'],
+            'top.nested': [[{'key1': 5, 'key2': 6}, {'key1': 7}], [{'key2': 8}], None]
+        })
+
+        expected_result = pd.DataFrame({
+            'nested.key1': [5., 7., None],
+            'nested.key2': [6., None, 8.],
+            'top.id': ['A', 'A', 'B']
+        })
+
+        # run test
+        result = SeerConnect.pandas_flatten(parent, 'top.', 'nested')
+
+        # check result
+        pd.testing.assert_frame_equal(result, expected_result)
+
+    def test_no_children(self):
+        # setup
+        parent = pd.DataFrame({'top.id': ['A', 'B'], 'top.nested': [[], None]})
+
+        # run test
+        result = SeerConnect.pandas_flatten(parent, 'top.', 'nested')
+
+        # check result
+        assert result.empty
+        assert list(result.columns) == ['top.id', 'nested.id']
+
+
+@mock.patch('time.sleep', return_value=None)
+@mock.patch('seerpy.seerpy.GQLClient', autospec=True)
+class TestGetAllStudyMetaDataByIds:
+    def test_batches_and_paginates_segments(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        def get_study(study_id, segment_ids):
+            return {
+                'id': study_id,
+                'channelGroups': [{
+                    'id': f'{study_id}-channel-group',
+                    'segments': [{
+                        'id': segment_id
+                    } for segment_id in segment_ids]
+                }]
+            }
+
+        side_effects = [
+            # first batch, the second study has a full page of segments
+            {
+                's0': get_study('study-1-id', ['segment-1']),
+                's1': get_study('study-2-id', ['segment-2', 'segment-3'])
+            },
+            # the remaining segments for the second study
+            {
+                'study': get_study('study-2-id', ['segment-4'])
+            },
+            # second batch
+            {
+                's0': get_study('study-3-id', [])
+            },
+        ]
+        gql_client.return_value.execute.side_effect = side_effects
+
+        # run test
+        result = seer_connect.get_all_study_metadata_by_ids(
+            ['study-1-id', 'study-2-id', 'study-3-id'], limit=2, batch_size=2)
+
+        # check result
+        assert result == {
+            'studies': [
+                get_study('study-1-id', ['segment-1']),
+                get_study('study-2-id', ['segment-2', 'segment-3', 'segment-4']),
+                get_study('study-3-id', [])
+            ]
+        }
+        call_variables = [
+            call[1]['variable_values'] for call in gql_client.return_value.execute.call_args_list
+        ]
+        assert call_variables == [{
+            's0': 'study-1-id',
+            's1': 'study-2-id',
+            'offset': 0,
+            'limit': 2
+        }, {
+            'study_id': 'study-2-id',
+            'offset': 2,
+            'limit': 2
+        }, {
+            's0': 'study-3-id',
+            'offset': 0,
+            'limit': 2
+        }]
+
 
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
@@ -315,16 +570,27 @@ class TestGetAllStudyMetaDataByNames:
         # this is the "no more data" response for get_studies()
         side_effects.append({'studies': []})
 
-        # these are the calls from the loop in get_all_study_metadata_by_ids()
+        # these are the calls from get_all_study_metadata_by_ids(), which may be made concurrently
+        # so are matched on study ID rather than call order
         expected_results = []
+        study_responses = {}
         for i in range(1, 5):
             filename = "study" + str(i) + "_metadata.json"
             with open(TEST_DATA_DIR / filename, "r") as f:
                 study = json.load(f)
-                side_effects.append(study)
+                study_responses[study['study']['id']] = study['study']
                 expected_results.append(study['study'])
 
-        gql_client.return_value.execute.side_effect = side_effects
+        def execute(unused_query, variable_values=None):
+            if 's0' in variable_values:
+                return {
+                    alias: study_responses[study_id]
+                    for alias, study_id in variable_values.items()
+                    if alias not in ('limit', 'offset')
+                }
+            return side_effects.pop(0)
+
+        gql_client.return_value.execute.side_effect = execute
 
         # run test
         result = seer_connect.get_all_study_metadata_by_names()
@@ -342,11 +608,11 @@ class TestGetAllStudyMetaDataByNames:
         # this is the "no more data" response for get_studies()
         side_effects.append({'studies': []})
 
-        # these are the calls from the loop in get_all_study_metadata_by_ids()
+        # this is the batched study query in get_all_study_metadata_by_ids()
         expected_results = []
         with open(TEST_DATA_DIR / "study1_metadata.json", "r") as f:
             study = json.load(f)
-            side_effects.append(study)
+            side_effects.append({'s0': study['study']})
             expected_results = [study['study']]
 
         gql_client.return_value.execute.side_effect = side_effects
@@ -470,6 +736,68 @@ class TestGetSegmentUrls:
         assert result.empty
 
 
+@mock.patch('time.sleep', return_value=None)
+@mock.patch('seerpy.seerpy.GQLClient', autospec=True)
+class TestGetChannelSegments:
+    @staticmethod
+    def make_page(segment_ids, end_cursor, has_next_page):
+        items = [{
+            'id': segment_id,
+            'startTime': 0,
+            'duration': 1000,
+            'timezone': 10,
+            'studyChannelGroup': {
+                'id': 'cg-1',
+                'name': 'Group 1'
+            }
+        } for segment_id in segment_ids]
+        return {
+            'resource': {
+                'channelGroupSegment': {
+                    'list': {
+                        'items': items,
+                        'pageInfo': {
+                            'endCursor': end_cursor,
+                            'hasNextPage': has_next_page
+                        }
+                    }
+                }
+            }
+        }
+
+    def test_follows_cursor(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        gql_client.return_value.execute.side_effect = [
+            self.make_page(['seg-1', 'seg-2'], 'cursor-1', True),
+            self.make_page(['seg-3'], 'cursor-2', False)
+        ]
+
+        # run test
+        result = seer_connect.get_channel_segments('study-1', limit=2)
+
+        # check result
+        assert result['segments.id'].tolist() == ['seg-1', 'seg-2', 'seg-3']
+        calls = gql_client.return_value.execute.call_args_list
+        assert len(calls) == 2
+        assert calls[0][1]['variable_values'] == {'study_id': 'study-1', 'limit': 2, 'after': ''}
+        assert calls[1][1]['variable_values'] == {
+            'study_id': 'study-1',
+            'limit': 2,
+            'after': 'cursor-1'
+        }
+
+    def test_empty(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        gql_client.return_value.execute.return_value = self.make_page([], None, False)
+
+        # run test
+        result = seer_connect.get_channel_segments('study-1')
+
+        # check result
+        assert result.empty
+        assert 'segments.id' in result.columns
+
+
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
 class TestGetLabels:
@@ -503,6 +831,31 @@ class TestGetLabels:
         # check result
         assert result == expected_result
 
+    def test_iter_labels(self, gql_client, unused_sleep, seer_connect):
+        # setup
+        side_effects = []
+
+        with open(TEST_DATA_DIR / "labels_1.json", "r") as f:
+            side_effects.append(json.load(f))
+        with open(TEST_DATA_DIR / "labels_2.json", "r") as f:
+            side_effects.append(json.load(f))
+        # this is the "no more data" response for get_labels()
+        with open(TEST_DATA_DIR / "labels_1_empty.json", "r") as f:
+            side_effects.append(json.load(f))
+
+        gql_client.return_value.execute.side_effect = side_effects
+
+        with open(TEST_DATA_DIR / "labels_result.json", "r") as f:
+            expected_result = json.load(f)
+
+        # run test
+        result = list(seer_connect.iter_labels("study-1-id", "label-group-1-id"))
+
+        # check result
+        assert len(result) == 2
+        assert [label for page in result for label in page
+                ] == expected_result['labelGroup']['labels']
+
 
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
@@ -529,6 +882,18 @@ class TestGetLabelsDataframe:
         # check result
         pd.testing.assert_frame_equal(result, expected_result)
 
+    def test_no_labels(self, unused_gql_client, unused_sleep, seer_connect):
+        # setup
+        label_results = {'labelGroup': {'id': 'label-group-1-id', 'name': 'group', 'labels': []}}
+
+        # run test
+        with mock.patch.object(seer_connect, 'get_labels', return_value=label_results):
+            result = seer_connect.get_labels_dataframe("study-1-id", "label-group-1-id")
+
+        # check result
+        assert result['labelGroup.id'].tolist() == ['label-group-1-id']
+        assert result['labels.id'].isna().all()
+
 
 @mock.patch('time.sleep', return_value=None)
 @mock.patch('seerpy.seerpy.GQLClient', autospec=True)
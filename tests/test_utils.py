@@ -1,9 +1,14 @@
 # Copyright 2017,2018 Seer Medical Pty Ltd, Inc. or its affiliates. All Rights Reserved.
 
 from collections import namedtuple
+import gzip
 import pathlib
+from unittest import mock
+import zlib
 
+import numpy as np
 import pandas as pd
+import pytest
 
 from seerpy import utils
 
@@ -141,6 +146,346 @@ class TestDownloadChannelData:
         # use check_dtype=False to save having to convert
         pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
 
+    def test_siesta_data_dict_row(self):
+        # setup
+        meta_data = {
+            'dataChunks.url': TEST_DATA_DIR / 'siesta_chunk_data_2s.dat',
+            'dataChunks.time': 1571729124019.5312,
+            'segments.startTime': 1571727804019.5312,
+            'segments.duration': 8138019.53125,
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.sampleRate': 256,
+            'channelGroups.samplesPerRecord': 256,
+            'channelGroups.recordsPerChunk': 10,
+            'channelGroups.compression': 'gzip',
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': -6,
+            'channelGroups.timestamped': False
+        }
+
+        study_id = 'siesta_study-id'
+        channel_groups_id = 'siesta-channel-group-id'
+        segments_id = 'siesta-segment-id'
+        channel_names = [
+            'fz', 'cz', 'pz', 'c3', 'f3', 'f4', 'p4', 'p3', 'a2', 't4', 'a1', 't3', 'fp1', 'fp2',
+            'o2', 'o1', 'f7', 'f8', 't6', 't5', 'c4'
+        ]
+
+        data_q = [meta_data, study_id, channel_groups_id, segments_id, channel_names]
+
+        # run test
+        result = utils.download_channel_data(data_q, self.mock_download_function)
+
+        # check result
+        expected_result = pd.read_csv(TEST_DATA_DIR / 'siesta_channel_data_2s.csv', index_col=0)
+        pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
+
+    def test_siesta_data_short(self):
+        # setup
+        meta_data = {
+            'dataChunks.url': TEST_DATA_DIR / 'siesta_chunk_data_2s.dat',
+            'dataChunks.time': 1571729124019.5312,
+            'segments.startTime': 1571727804019.5312,
+            'segments.duration': 1321000.,  # 1 second after chunk start
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.sampleRate': 256,
+            'channelGroups.samplesPerRecord': 256,
+            'channelGroups.recordsPerChunk': 10,
+            'channelGroups.compression': 'gzip',
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': -6,
+            'channelGroups.timestamped': False
+        }
+        channel_names = [
+            'fz', 'cz', 'pz', 'c3', 'f3', 'f4', 'p4', 'p3', 'a2', 't4', 'a1', 't3', 'fp1', 'fp2',
+            'o2', 'o1', 'f7', 'f8', 't6', 't5', 'c4'
+        ]
+        data_q = [
+            meta_data, 'siesta_study-id', 'siesta-channel-group-id', 'siesta-segment-id',
+            channel_names
+        ]
+
+        # run test
+        result = utils.download_channel_data(data_q, self.mock_download_function)
+
+        # check result
+        expected_result = pd.read_csv(TEST_DATA_DIR / 'siesta_channel_data_2s.csv', index_col=0)
+        expected_result = expected_result.iloc[:256]
+        pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
+
+    def test_siesta_data_time_range(self):
+        # setup
+        meta_data = {
+            'dataChunks.url': TEST_DATA_DIR / 'siesta_chunk_data_2s.dat',
+            'dataChunks.time': 1571729124019.5312,
+            'segments.startTime': 1571727804019.5312,
+            'segments.duration': 8138019.53125,
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.sampleRate': 256,
+            'channelGroups.samplesPerRecord': 256,
+            'channelGroups.recordsPerChunk': 10,
+            'channelGroups.compression': 'gzip',
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': -6,
+            'channelGroups.timestamped': False
+        }
+        channel_names = [
+            'fz', 'cz', 'pz', 'c3', 'f3', 'f4', 'p4', 'p3', 'a2', 't4', 'a1', 't3', 'fp1', 'fp2',
+            'o2', 'o1', 'f7', 'f8', 't6', 't5', 'c4'
+        ]
+        data_q = [
+            meta_data, 'siesta_study-id', 'siesta-channel-group-id', 'siesta-segment-id',
+            channel_names
+        ]
+
+        # run test
+        # the half second starting half a second into the chunk
+        result = utils.download_channel_data(data_q, self.mock_download_function,
+                                             from_time=1571729124519.5312,
+                                             to_time=1571729125019.5312)
+
+        # check result
+        expected_result = pd.read_csv(TEST_DATA_DIR / 'siesta_channel_data_2s.csv', index_col=0)
+        expected_result = expected_result.iloc[128:256].reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
+
+    def test_siesta_data_streamed(self):
+        # setup
+        meta_data = {
+            'dataChunks.url': TEST_DATA_DIR / 'siesta_chunk_data_2s.dat',
+            'dataChunks.time': 1571729124019.5312,
+            'segments.startTime': 1571727804019.5312,
+            'segments.duration': 8138019.53125,
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.sampleRate': 256,
+            'channelGroups.samplesPerRecord': 256,
+            'channelGroups.recordsPerChunk': 10,
+            'channelGroups.compression': 'gzip',
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': -6,
+            'channelGroups.timestamped': False
+        }
+        channel_names = [
+            'fz', 'cz', 'pz', 'c3', 'f3', 'f4', 'p4', 'p3', 'a2', 't4', 'a1', 't3', 'fp1', 'fp2',
+            'o2', 'o1', 'f7', 'f8', 't6', 't5', 'c4'
+        ]
+        data_q = [
+            meta_data, 'siesta_study-id', 'siesta-channel-group-id', 'siesta-segment-id',
+            channel_names
+        ]
+
+        content = self.mock_download_function(meta_data['dataChunks.url']).content
+        response = mock.Mock(status_code=200)
+        # deliver the compressed body in small pieces, as a streamed response would
+        response.iter_content.return_value = [
+            content[i:i + 1000] for i in range(0, len(content), 1000)
+        ]
+
+        # run test
+        result = utils.download_channel_data(data_q, lambda url: response)
+
+        # check result
+        expected_result = pd.read_csv(TEST_DATA_DIR / 'siesta_channel_data_2s.csv', index_col=0)
+        pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
+
+    def test_chunk_after_to_time(self):
+        # setup
+        meta_data = {
+            'dataChunks.url': 'https://example.com/00000000001.dat',
+            'dataChunks.time': 1571729124019.5312,
+            'segments.startTime': 1571727804019.5312,
+            'segments.duration': 8138019.53125,
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.timestamped': False
+        }
+        data_q = [meta_data, 'study-id', 'channel-group-id', 'segment-id', ['fz', 'cz']]
+        download_function = mock.Mock()
+
+        # run test
+        result = utils.download_channel_data(data_q, download_function,
+                                             to_time=1571729124019.5312)
+
+        # check result
+        assert result is None
+        download_function.assert_not_called()
+
+    def test_int_data_missing_values(self):
+        # setup
+        missing = np.iinfo(np.int16).min
+        rows = np.array([[32767, 32767], [missing, missing], [32767, missing], [32767, 32767],
+                         [missing, missing], [missing, missing]], dtype=np.int16)
+        # EDF data is stored record by record, with each channel's samples contiguous in a record
+        content = rows.reshape(3, 2, 2).transpose(0, 2, 1).tobytes()
+
+        meta_data = {
+            'dataChunks.url': 'url',
+            'dataChunks.time': 1000.,
+            'segments.startTime': 1000.,
+            'segments.duration': 10000.,
+            'channelGroups.sampleEncoding': 'int16',
+            'channelGroups.sampleRate': 2,
+            'channelGroups.samplesPerRecord': 2,
+            'channelGroups.recordsPerChunk': 3,
+            'channelGroups.compression': None,
+            'channelGroups.signalMin': -1,
+            'channelGroups.signalMax': 1,
+            'channelGroups.exponent': 0,
+            'channelGroups.timestamped': False
+        }
+        data_q = [meta_data, 'study-id', 'channel-group-id', 'segment-id', ['ch1', 'ch2']]
+
+        # run test
+        result = utils.download_channel_data(data_q, lambda url: MockResponse(content))
+
+        # check result
+        # trailing rows of missing values are dropped, internal ones are filled with 0
+        assert result['time'].tolist() == [1000., 1500., 2000., 2500.]
+        np.testing.assert_allclose(result['ch1'], [1., 0., 1., 1.])
+        np.testing.assert_allclose(result['ch2'], [1., 0., -1., 1.])
+
+    def test_int_data_dtypes(self):
+        # setup
+        content = np.array([[-32768, 0], [32767, 100]], dtype=np.int16).tobytes()
+        meta_data = {
+            'dataChunks.url': 'url',
+            'dataChunks.time': 1000.,
+            'segments.startTime': 1000.,
+            'segments.duration': 10000.,
+            'channelGroups.sampleEncoding': 'int16',
+            'channelGroups.sampleRate': 2,
+            'channelGroups.samplesPerRecord': 2,
+            'channelGroups.recordsPerChunk': 1,
+            'channelGroups.compression': None,
+            'channelGroups.signalMin': -1,
+            'channelGroups.signalMax': 1,
+            'channelGroups.exponent': 0,
+            'channelGroups.timestamped': False
+        }
+        data_q = [meta_data, 'study-id', 'channel-group-id', 'segment-id', ['ch1', 'ch2']]
+
+        # run test
+        result = utils.download_channel_data(data_q, lambda url: MockResponse(content))
+
+        # check result
+        # channel values are returned as float32, as they always have been, and times as float64
+        assert result['time'].dtype == np.float64
+        assert result['ch1'].dtype == np.float32
+        assert result['ch2'].dtype == np.float32
+
+    def test_int_data_large_offset(self):
+        # setup
+        rows = np.array([[-32767, -100], [0, 12345], [32767, 1]], dtype=np.int16)
+        content = rows.reshape(1, 3, 2).transpose(0, 2, 1).tobytes()
+        meta_data = {
+            'dataChunks.url': 'url',
+            'dataChunks.time': 1000.,
+            'segments.startTime': 1000.,
+            'segments.duration': 10000.,
+            'channelGroups.sampleEncoding': 'int16',
+            'channelGroups.sampleRate': 3,
+            'channelGroups.samplesPerRecord': 3,
+            'channelGroups.recordsPerChunk': 1,
+            'channelGroups.compression': None,
+            'channelGroups.signalMin': 123456.789,
+            'channelGroups.signalMax': 123457.789,
+            'channelGroups.exponent': -3,
+            'channelGroups.timestamped': False
+        }
+        data_q = [meta_data, 'study-id', 'channel-group-id', 'segment-id', ['ch1', 'ch2']]
+
+        # run test
+        result = utils.download_channel_data(data_q, lambda url: MockResponse(content))
+
+        # check result
+        # the conversion is done in float64, so the values are only rounded once, to float32
+        expected = ((rows.astype(np.float64) + 32768) / 65535 + 123456.789) * 1e-3
+        np.testing.assert_array_equal(result[['ch1', 'ch2']].to_numpy(),
+                                      expected.astype(np.float32))
+
+    def test_float_data_missing_values(self):
+        # setup
+        rows = np.array([[1., np.nan, 3.], [np.nan, np.nan, 6.], [np.nan, np.nan, np.nan]],
+                        dtype=np.float32)
+        content = rows.reshape(1, 3, 3).transpose(0, 2, 1).tobytes()
+
+        meta_data = {
+            'dataChunks.url': 'url',
+            'dataChunks.time': 0.,
+            'segments.startTime': 0.,
+            'segments.duration': 10000.,
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.sampleRate': 1,
+            'channelGroups.samplesPerRecord': 3,
+            'channelGroups.recordsPerChunk': 1,
+            'channelGroups.compression': None,
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': 0,
+            'channelGroups.timestamped': False
+        }
+        data_q = [meta_data, 'study-id', 'channel-group-id', 'segment-id', ['ch1', 'ch2', 'ch3']]
+
+        # run test
+        result = utils.download_channel_data(data_q, lambda url: MockResponse(content))
+
+        # check result
+        # missing values are filled from the previous channel, then the next, then with 0
+        assert result.columns.tolist() == [
+            'time', 'id', 'channelGroups.id', 'segments.id', 'ch1', 'ch2', 'ch3'
+        ]
+        np.testing.assert_array_equal(result[['ch1', 'ch2', 'ch3']].values,
+                                      [[1., 1., 3.], [6., 6., 6.], [0., 0., 0.]])
+
+
+class TestGzipDecompress:
+    def test_gzipped_pieces(self):
+        # setup
+        content = gzip.compress(b'first member') + gzip.compress(b', second member')
+        chunks = [content[i:i + 3] for i in range(0, len(content), 3)]
+
+        # run test
+        result = utils._gzip_decompress(chunks)  # pylint:disable=protected-access
+
+        # check result
+        assert result == b'first member, second member'
+
+    def test_not_gzipped_short_pieces_isal(self):
+        # setup
+        isal_zlib = pytest.importorskip('isal.isal_zlib')
+
+        # run test
+        with mock.patch.object(utils, 'zlib', isal_zlib):
+            # pylint:disable=protected-access
+            result = utils._gzip_decompress([b'ab', b'cdefghijklmnop'])
+            short_result = utils._gzip_decompress([b'abc'])
+
+        # check result
+        assert result == b'abcdefghijklmnop'
+        assert short_result == b'abc'
+
+    @mock.patch.object(utils, 'zlib', zlib)
+    def test_not_gzipped_short_pieces_zlib(self):
+        # run test
+        # pylint:disable=protected-access
+        result = utils._gzip_decompress([b'ab', b'cdefghijklmnop'])
+        short_result = utils._gzip_decompress([b'abc'])
+
+        # check result
+        assert result == b'abcdefghijklmnop'
+        assert short_result == b'abc'
+
+    def test_truncated(self):
+        # setup
+        content = gzip.compress(b'some data')
+
+        # run test and check result
+        with pytest.raises(EOFError):
+            utils._gzip_decompress([content[:-4]])  # pylint:disable=protected-access
+
 
 class TestCreateDataChunkUrls:
     def test_success(self):
@@ -227,3 +572,230 @@ class TestCreateDataChunkUrls:
 
     def test_quote_str(self):
         assert utils.quote_str('test') == '"test"'
+
+
+class TestGetChannelData:
+    @staticmethod
+    def mock_download_function(filename):
+        with open(filename, mode='rb') as f:
+            content = f.read()
+        return MockResponse(content)
+
+    @staticmethod
+    def get_study_metadata(channel_names, **kwargs):
+        return pd.DataFrame([{
+            **kwargs, 'channels.id': f'{channel_name}-id',
+            'channels.name': channel_name
+        } for channel_name in channel_names])
+
+    def test_multiple_channel_groups(self):
+        # setup
+        sense_channel_names = [
+            'a1', 't3', 'p3', 'c3', 'cz', 'f7', 'o2', 't5', 'c4', 'f8', 'pz', 'fp2', 'f4', 'o1',
+            'f3', 'fp1', 'fz', 'a2', 't6', 't4', 'p4'
+        ]
+        siesta_channel_names = [
+            'fz', 'cz', 'pz', 'c3', 'f3', 'f4', 'p4', 'p3', 'a2', 't4', 'a1', 't3', 'fp1', 'fp2',
+            'o2', 'o1', 'f7', 'f8', 't6', 't5', 'c4'
+        ]
+        common_metadata = {
+            'channelGroups.sampleEncoding': 'float32',
+            'channelGroups.recordsPerChunk': 10,
+            'channelGroups.compression': 'gzip',
+            'channelGroups.signalMin': 0,
+            'channelGroups.signalMax': 0,
+            'channelGroups.exponent': -6,
+        }
+        study_metadata = pd.concat([
+            self.get_study_metadata(
+                siesta_channel_names, **common_metadata, **{
+                    'id': 'siesta_study-id',
+                    'channelGroups.id': 'siesta-channel-group-id',
+                    'segments.id': 'siesta-segment-id',
+                    'segments.startTime': 1571727804019.5312,
+                    'segments.duration': 8138019.53125,
+                    'channelGroups.sampleRate': 256,
+                    'channelGroups.samplesPerRecord': 256,
+                    'channelGroups.timestamped': False
+                }),
+            self.get_study_metadata(
+                sense_channel_names, **common_metadata, **{
+                    'id': 'sense-study-id',
+                    'channelGroups.id': 'sense-channel-group-id',
+                    'segments.id': 'sense-segment-id',
+                    'segments.startTime': 1593760697000.,
+                    'segments.duration': 2362000.,
+                    'channelGroups.sampleRate': 250,
+                    'channelGroups.samplesPerRecord': 250,
+                    'channelGroups.timestamped': True
+                })
+        ], ignore_index=True)
+        data_chunk_urls = pd.DataFrame({
+            'segments.id': ['siesta-segment-id', 'sense-segment-id'],
+            'dataChunks.time': [1571729124019.5312, 1593760757000.],
+            'dataChunks.url': [
+                TEST_DATA_DIR / 'siesta_chunk_data_2s.dat', TEST_DATA_DIR / 'sense_chunk_data_1s.dat'
+            ]
+        })
+
+        # columns are ordered by the first segment downloaded, rows are sorted by study ID
+        expected_result = pd.concat([
+            pd.read_csv(TEST_DATA_DIR / 'siesta_channel_data_2s.csv', index_col=0),
+            pd.read_csv(TEST_DATA_DIR / 'sense_channel_data_1s.csv', index_col=0)
+        ], sort=False)
+        expected_result = expected_result.sort_values(['id', 'channelGroups.id', 'time'])
+        expected_result = expected_result.reset_index(drop=True)
+
+        # run test
+        result = utils.get_channel_data(study_metadata, data_chunk_urls,
+                                        self.mock_download_function, threads=1)
+
+        # check result
+        pd.testing.assert_frame_equal(result, expected_result, check_dtype=False)
+
+
+class TestGetChannelNamesOrIds:
+    def test_missing_and_duplicate_names(self):
+        # setup
+        metadata = pd.DataFrame({
+            'channels.id': ['id-1', 'id-2', 'id-3', 'id-4', 'id-5', 'id-5'],
+            'channels.name': ['dup', 'dup', None, '', 'unique', 'unique']
+        })
+
+        # run test
+        result = utils.get_channel_names_or_ids(metadata)
+
+        # check result
+        assert result == ['id-1', 'id-2', 'id-3', 'id-4', 'unique']
+
+
+@mock.patch('time.sleep', return_value=None)
+@mock.patch('time.monotonic', return_value=0.)
+class TestSlidingWindowRateLimiter:
+    def test_burst_does_not_wait(self, unused_monotonic, sleep):
+        # setup
+        limiter = utils.SlidingWindowRateLimiter(max_calls=5, period=10.)
+
+        # run test
+        wait_times = [limiter.acquire() for _ in range(5)]
+
+        # check result
+        assert wait_times == [0.] * 5
+        assert not sleep.called
+
+    def test_waits_once_window_is_full(self, monotonic, sleep):
+        # setup
+        limiter = utils.SlidingWindowRateLimiter(max_calls=2, period=10.)
+        limiter.acquire()
+        monotonic.return_value = 4.
+        limiter.acquire()
+
+        # run test
+        monotonic.return_value = 6.
+        wait_times = [limiter.acquire() for _ in range(3)]
+
+        # check result
+        # each call waits for the call two before it to leave the window
+        assert wait_times == [4., 8., 14.]
+        assert sleep.call_count == 3
+
+    def test_full_rate_over_many_windows(self, monotonic, unused_sleep):
+        # setup
+        limiter = utils.SlidingWindowRateLimiter(max_calls=10, period=10.)
+
+        # run test
+        total_wait = 0.
+        for _ in range(50):
+            wait_time = limiter.acquire()
+            total_wait += wait_time
+            monotonic.return_value += wait_time
+
+        # check result
+        # 50 calls at 10 per 10 seconds only need to wait for 4 windows to pass
+        assert total_wait == 40.
+
+    def test_window_slides(self, monotonic, sleep):
+        # setup
+        limiter = utils.SlidingWindowRateLimiter(max_calls=2, period=10.)
+        limiter.acquire()
+        limiter.acquire()
+
+        # run test
+        monotonic.return_value = 10.
+        result = limiter.acquire()
+
+        # check result
+        assert result == 0.
+        assert not sleep.called
+
+
+@mock.patch('time.monotonic', return_value=0.)
+class TestTTLCache:
+    def test_get_returns_copy(self, unused_monotonic):
+        # setup
+        cache = utils.TTLCache()
+        cache.set('key', {'a': [1]})
+
+        # run test
+        result = cache.get('key')
+        result['a'].append(2)
+
+        # check result
+        assert cache.get('key') == {'a': [1]}
+
+    def test_expiry(self, monotonic):
+        # setup
+        cache = utils.TTLCache(ttl=10)
+        cache.set('key', 'value')
+
+        # run test and check result
+        monotonic.return_value = 9.
+        assert cache.get('key') == 'value'
+        monotonic.return_value = 10.
+        assert cache.get('key') is None
+
+    def test_evicts_least_recently_used(self, unused_monotonic):
+        # setup
+        cache = utils.TTLCache(maxsize=2)
+        cache.set('key1', 1)
+        cache.set('key2', 2)
+        cache.get('key1')
+
+        # run test
+        cache.set('key3', 3)
+
+        # check result
+        assert cache.get('key1') == 1
+        assert cache.get('key2') is None
+        assert cache.get('key3') == 3
+
+
+class TestGetNestedDictItem:
+    def test_nested_item(self):
+        # setup
+        input_dict = {'a': {'b': {'c': 42}}}
+
+        # run test
+        result = utils.get_nested_dict_item(input_dict, ['a', 'b', 'c'])
+
+        # check result
+        assert result == 42
+
+    def test_missing_keys_allowed(self):
+        # setup
+        input_dict = {'a': {'b': 33, 'z': 42}}
+
+        # run test
+        result = utils.get_nested_dict_item(input_dict, ['a', 'b', 'c'], allow_missing_keys=True,
+                                            default=999)
+
+        # check result
+        assert result == 999
+
+    def test_missing_keys_not_allowed(self):
+        # setup
+        input_dict = {'a': {'b': {'c': 42}}}
+
+        # run test and check result
+        with pytest.raises(KeyError):
+            utils.get_nested_dict_item(input_dict, ['a', 'x', 'y'])